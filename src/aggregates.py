@@ -0,0 +1,316 @@
+"""
+================
+aggregates.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the summary tables read by dashboard.py instead of grouping the whole
+review table on each chart, including the frequency of the words of the summaries of each
+type used by the word cloud. load_data.py and insert_dataset.py add the reviews they write
+to the summaries and commit them in the same transaction as the reviews, so the tables are
+always consistent with review, also after resuming a load.
+
+Regarding the configuration parameters, there are none. Running this file rebuilds the
+summaries of an existing database from the review table.
+"""
+
+import config as c
+import pymysql
+from data_version import create_data_version_table, bump_data_version
+from sql_indexes import create_sql_indexes
+import re
+from collections import Counter
+from pymongo import MongoClient
+from pymysql.cursors import SSCursor
+from wordcloud import STOPWORDS
+
+# The columns of the keys cannot be NULL, so the missing values are stored as '' or 0 and
+# the dashboard turns them back into NULL with NULLIF
+SQL_AGGREGATE_TABLES = {
+    # Reviews, reviews with rating and sum of the ratings of each type and year
+    "agg_type_year": """
+        CREATE TABLE IF NOT EXISTS agg_type_year (
+            type VARCHAR(80) NOT NULL,
+            year INT NOT NULL,
+            reviews INT NOT NULL,
+            rated INT NOT NULL,
+            overall_sum INT NOT NULL,
+            PRIMARY KEY (type, year)
+        );""",
+    # Reviews of each product and rating
+    "agg_rating": """
+        CREATE TABLE IF NOT EXISTS agg_rating (
+            type VARCHAR(80) NOT NULL,
+            asin VARCHAR(40) NOT NULL,
+            overall INT NOT NULL,
+            reviews INT NOT NULL,
+            PRIMARY KEY (type, asin, overall),
+            INDEX idx_agg_rating_asin (asin)
+        );""",
+    # Reviews of each reviewer
+    "agg_reviewer": """
+        CREATE TABLE IF NOT EXISTS agg_reviewer (
+            reviewerID VARCHAR(40) NOT NULL,
+            reviews INT NOT NULL,
+            PRIMARY KEY (reviewerID)
+        );""",
+    # Appearances of each word in the summaries of each type
+    "agg_term": """
+        CREATE TABLE IF NOT EXISTS agg_term (
+            type VARCHAR(80) NOT NULL,
+            term VARCHAR(100) NOT NULL,
+            frequency INT NOT NULL,
+            PRIMARY KEY (type, term),
+            INDEX idx_agg_term_frequency (type, frequency)
+        );""",
+}
+
+# The year of reviewTime, 0 if there is none
+SQL_YEAR = "COALESCE(review_year, 0)"
+
+SQL_REBUILD = {
+    "agg_type_year": f"""
+        INSERT INTO agg_type_year (type, year, reviews, rated, overall_sum)
+            SELECT COALESCE(type, ''), {SQL_YEAR}, COUNT(*), COUNT(overall),
+                   COALESCE(SUM(overall), 0)
+                FROM review
+                GROUP BY COALESCE(type, ''), {SQL_YEAR};""",
+    "agg_rating": """
+        INSERT INTO agg_rating (type, asin, overall, reviews)
+            SELECT COALESCE(type, ''), COALESCE(asin, ''), COALESCE(overall, 0), COUNT(*)
+                FROM review
+                GROUP BY COALESCE(type, ''), COALESCE(asin, ''), COALESCE(overall, 0);""",
+    "agg_reviewer": """
+        INSERT INTO agg_reviewer (reviewerID, reviews)
+            SELECT reviewerID, COUNT(*)
+                FROM review
+                WHERE reviewerID IS NOT NULL
+                GROUP BY reviewerID;""",
+}
+
+SQL_ADD = {
+    "agg_type_year": """
+        INSERT INTO agg_type_year (type, year, reviews, rated, overall_sum)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE reviews = reviews + VALUES(reviews),
+                                    rated = rated + VALUES(rated),
+                                    overall_sum = overall_sum + VALUES(overall_sum);""",
+    "agg_rating": """
+        INSERT INTO agg_rating (type, asin, overall, reviews)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE reviews = reviews + VALUES(reviews);""",
+    "agg_reviewer": """
+        INSERT INTO agg_reviewer (reviewerID, reviews)
+            VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE reviews = reviews + VALUES(reviews);""",
+    "agg_term": """
+        INSERT INTO agg_term (type, term, frequency)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE frequency = frequency + VALUES(frequency);""",
+}
+
+# Reviews read at a time when agg_term is rebuilt
+REBUILD_SIZE = 10000
+
+# Words as WordCloud finds them in a text
+WORD = re.compile(r"\w[\w']+")
+
+
+def review_year(review_time) -> int:
+    """
+    Returns the year of a reviewTime, like SQL_YEAR
+
+    Args:
+        review_time (str or date): the reviewTime in year-month-day format, or None
+
+    Returns:
+        int: the year, 0 if it is not known
+    """
+    if review_time is None:
+        return 0
+    return int(str(review_time).split("-")[0])
+
+
+def summary_terms(summary) -> list:
+    """
+    Returns the words of a summary that the word cloud shows: the ones of more than two
+    characters, in lowercase, without the final 's, numbers and the stopwords of WordCloud
+
+    Args:
+        summary (str): the summary of a review, or None
+
+    Returns:
+        list: the words, repeated as many times as they appear
+    """
+    text = " ".join(word for word in (summary or "").split() if len(word) > 2)
+    terms = []
+    for word in WORD.findall(text.lower()):
+        if word.endswith("'s"):
+            word = word[:-2]
+        if word and not word.isdigit() and word not in STOPWORDS and len(word) <= 100:
+            terms.append(word)
+    return terms
+
+
+def ensure_aggregate_tables(cursor) -> None:
+    """
+    Creates the summary tables that do not exist and fills them from review, so a
+    database created before them can be used by the loaders and the dashboard
+
+    Args:
+        cursor: cursor of the SQL connection
+    """
+    cursor.execute(
+        """SELECT table_name
+            FROM information_schema.tables
+            WHERE table_schema = DATABASE();"""
+    )
+    existing = {row[0] for row in cursor.fetchall()}
+    missing = [table for table in SQL_AGGREGATE_TABLES if table not in existing]
+    for table in missing:
+        cursor.execute(SQL_AGGREGATE_TABLES[table])
+    if missing:
+        rebuild_aggregates(cursor, missing)
+        cursor.connection.commit()
+    # Also adds the indexes to the tables created before them
+    create_sql_indexes(cursor, list(SQL_AGGREGATE_TABLES))
+
+
+def rebuild_aggregates(cursor, tables=None) -> None:
+    """
+    Fills the summary tables again from review, without committing
+
+    Args:
+        cursor: cursor of the SQL connection
+        tables (list, optional): the tables to rebuild. Defaults to all of them.
+    """
+    for table in tables or SQL_AGGREGATE_TABLES:
+        cursor.execute(f"DELETE FROM {table};")
+        if table == "agg_term":
+            rebuild_terms(cursor)
+        else:
+            cursor.execute(SQL_REBUILD[table])
+
+
+def rebuild_terms(cursor) -> None:
+    """
+    Fills agg_term from the summaries stored in MongoDB, without committing
+
+    Args:
+        cursor: cursor of the SQL connection
+    """
+    collection = MongoClient("mongodb://localhost:27017")[c.NOMBRE_BASE_MONGODB][
+        c.NOMBRE_TABLA_MONGODB
+    ]
+    aggregates = Aggregates()
+    # The type of each review is in SQL, so they are read in blocks of ids
+    with cursor.connection.cursor(SSCursor) as review_cursor:
+        review_cursor.execute("SELECT id, type FROM review;")
+        while rows := review_cursor.fetchmany(REBUILD_SIZE):
+            types = dict(rows)
+            for document in collection.find(
+                {"id": {"$in": list(types)}}, {"id": 1, "summary": 1, "_id": 0}
+            ):
+                aggregates.add_terms(types[document["id"]], document.get("summary"))
+    aggregates.apply(cursor)
+
+
+class Aggregates:
+    """
+    Changes to the summary tables made by the reviews written since the last commit. The
+    reviews are added with add (and their summaries with add_terms), and apply is passed
+    to the commit of the writer as a hook so the changes are written in the same
+    transaction as the reviews
+    """
+
+    def __init__(self):
+        guide = c.GUIAS_TABLAS_SQL["review"]
+        self.positions = {
+            column: guide.index(column)
+            for column in ["reviewerID", "asin", "type", "overall", "reviewTime"]
+        }
+        self.clear()
+
+    def clear(self):
+        """Forgets the changes."""
+        # (type, year) -> [reviews, rated, overall_sum]
+        self.type_year = {}
+        self.rating = Counter()
+        self.reviewers = Counter()
+        self.terms = Counter()
+
+    def add(self, row, sign=1):
+        """
+        Adds a review to the summaries, or removes it with sign -1
+
+        Args:
+            row (list): values of the review in the order of its table guide
+            sign (int, optional): 1 to add the review, -1 to remove it. Defaults to 1.
+        """
+        p = self.positions
+        review_type = row[p["type"]] or ""
+        overall = row[p["overall"]]
+        totals = self.type_year.setdefault(
+            (review_type, review_year(row[p["reviewTime"]])), [0, 0, 0]
+        )
+        totals[0] += sign
+        if overall is not None:
+            totals[1] += sign
+            totals[2] += sign * int(overall)
+        self.rating[(review_type, row[p["asin"]] or "", int(overall or 0))] += sign
+        if row[p["reviewerID"]] is not None:
+            self.reviewers[row[p["reviewerID"]]] += sign
+
+    def add_terms(self, review_type, summary):
+        """
+        Adds the words of a summary to the frequencies of its type
+
+        Args:
+            review_type (str): the type of the review
+            summary (str): the summary of the review, or None
+        """
+        for term in summary_terms(summary):
+            self.terms[(review_type or "", term)] += 1
+
+    def apply(self, cursor):
+        """
+        Writes the changes to the summary tables and forgets them. It is a commit hook
+
+        Args:
+            cursor: cursor of the SQL connection
+        """
+        changes = {
+            "agg_type_year": [
+                (*key, *totals) for key, totals in self.type_year.items() if any(totals)
+            ],
+            "agg_rating": [(*key, n) for key, n in self.rating.items() if n],
+            "agg_reviewer": [(key, n) for key, n in self.reviewers.items() if n],
+            "agg_term": [(*key, n) for key, n in self.terms.items()],
+        }
+        # The rows are written sorted by key, so loads that run at the same time lock the
+        # rows they share in the same order and do not deadlock
+        for table, rows in changes.items():
+            if rows:
+                cursor.executemany(SQL_ADD[table], sorted(rows))
+        self.clear()
+
+
+if __name__ == "__main__":
+    mysql_connection = pymysql.connect(
+        host="localhost",
+        user=c.USUARIO_SQL,
+        password=c.PASSWORD_SQL,
+        database=c.NOMBRE_BASE_SQL,
+    )
+
+    with mysql_connection:
+        cursor = mysql_connection.cursor()
+        for sql in SQL_AGGREGATE_TABLES.values():
+            cursor.execute(sql)
+        create_sql_indexes(cursor, list(SQL_AGGREGATE_TABLES))
+        create_data_version_table(cursor)
+        rebuild_aggregates(cursor)
+        bump_data_version(cursor)
+        mysql_connection.commit()
+        cursor.close()
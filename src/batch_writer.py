@@ -0,0 +1,408 @@
+"""
+================
+batch_writer.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the writers used by load_data.py and insert_dataset.py to send the
+rows to SQL and MongoDB in batches instead of one by one, and the one used to upsert a
+refreshed file with insert_dataset.py --upsert.
+
+Regarding the configuration parameters, the batch size can be changed with TAMANO_LOTE.
+"""
+
+import config as c
+import pymysql
+from pymongo import UpdateOne
+from time import perf_counter
+from profiler import PROFILER
+
+# Tables shared by every load and the number of columns of their primary key, which are
+# the first ones of their guide
+SHARED_TABLES = {"reviewer": 1, "product": 2}
+
+
+class BatchWriter:
+    """
+    Buffers the rows of each SQL table and the MongoDB documents and writes them
+    in batches with executemany (which pymysql turns into multi-row INSERTs) and
+    unordered insert_many
+
+    Args:
+        cursor: cursor of the SQL connection used for the load
+        collection: MongoDB collection where the documents are inserted
+        sql_insertions (dict): parameterized INSERT query of each table
+        batch_size (int, optional): rows kept in each buffer before writing them.
+                                    Defaults to TAMANO_LOTE.
+        shared_cursor (optional): cursor of a connection in autocommit mode where the
+                                  reviewers and products are written, if other loads
+                                  may run at the same time. Defaults to None (the cursor
+                                  of the load).
+    """
+
+    def __init__(
+        self, cursor, collection, sql_insertions, batch_size=None, shared_cursor=None
+    ):
+        self.cursor = cursor
+        self.shared_cursor = shared_cursor
+        self.collection = collection
+        self.sql_insertions = sql_insertions
+        self.batch_size = batch_size or c.TAMANO_LOTE
+
+        self.rows = {table_name: [] for table_name in sql_insertions}
+        self.documents = []
+        # Rows written and seconds spent by each sink, used in the final report
+        self.stats = {
+            sink: {"rows": 0, "time": 0.0}
+            for sink in list(sql_insertions) + ["mongodb"]
+        }
+
+    def add_row(self, table_name, row):
+        """
+        Adds a row to the buffer of a table, writing the SQL buffers if it is full
+
+        Args:
+            table_name (str): name of the table
+            row (list): values of the row in the order of the table guide
+        """
+        self.rows[table_name].append(row)
+        if len(self.rows[table_name]) >= self.batch_size:
+            self.flush_sql()
+
+    def add_document(self, document):
+        """
+        Adds a document to the MongoDB buffer, writing it if it is full
+
+        Args:
+            document (dict): the document to insert
+        """
+        self.documents.append(document)
+        if len(self.documents) >= self.batch_size:
+            self.flush_mongodb()
+
+    def flush_sql(self):
+        """Writes all the SQL buffers."""
+        rows, self.rows = self.rows, {table_name: [] for table_name in self.rows}
+        self.write_sql(rows)
+
+    def write_sql(self, rows):
+        """
+        Writes the rows of each table. They are written in the order of GUIAS_TABLAS_SQL,
+        so the reviewers and products always exist before the reviews that reference them.
+        With a shared cursor the reviewers and products are committed on their own, sorted
+        by their key. Otherwise two loads that insert the same reviewers in a different
+        order would each lock one of them until their next checkpoint and wait for the
+        other, a deadlock that aborts one of the loads
+
+        Args:
+            rows (dict): the rows of each table
+        """
+        for table_name, table_rows in rows.items():
+            if not table_rows:
+                continue
+            cursor = self.cursor
+            if self.shared_cursor is not None and table_name in SHARED_TABLES:
+                cursor = self.shared_cursor
+                n_key = SHARED_TABLES[table_name]
+                table_rows = sorted(table_rows, key=lambda row: row[:n_key])
+            t = perf_counter()
+            cursor.executemany(self.sql_insertions[table_name], table_rows)
+            t = perf_counter() - t
+            self.stats[table_name]["time"] += t
+            PROFILER.record("sql_insert", t)
+            self.stats[table_name]["rows"] += len(table_rows)
+
+    def flush_mongodb(self):
+        """Writes the MongoDB buffer."""
+        documents, self.documents = self.documents, []
+        self.write_mongodb(documents)
+
+    def write_mongodb(self, documents):
+        """
+        Inserts the documents in MongoDB
+
+        Args:
+            documents (list): the documents to insert
+        """
+        if not documents:
+            return
+        t = perf_counter()
+        # With ordered=False the server can apply the batch in parallel
+        self.collection.insert_many(documents, ordered=False)
+        t = perf_counter() - t
+        self.stats["mongodb"]["time"] += t
+        PROFILER.record("mongodb_insert", t)
+        self.stats["mongodb"]["rows"] += len(documents)
+
+    def flush(self):
+        """Writes every buffer that still has data."""
+        self.flush_sql()
+        self.flush_mongodb()
+
+    def commit(self, *hooks):
+        """
+        Writes every buffer and commits the SQL transaction. MongoDB is always written
+        before the commit, so it is never behind SQL
+
+        Args:
+            hooks (function): functions called with the cursor before committing, to
+                              write something in the same transaction (e.g. a checkpoint)
+        """
+        self.flush()
+        t = perf_counter()
+        for hook in hooks:
+            hook(self.cursor)
+        self.cursor.connection.commit()
+        PROFILER.record("commit", perf_counter() - t)
+
+    def close(self):
+        """Releases the resources of the writer. The buffers must have been committed."""
+
+    def report(self):
+        """Prints the rows written per second by each sink."""
+        for sink, stats in self.stats.items():
+            rate = stats["rows"] / stats["time"] if stats["time"] else 0
+            print(
+                f"{sink}: {stats['rows']} rows in {stats['time']:.2f} s ({rate:.0f} rows/s)"
+            )
+
+
+class UpsertWriter(BatchWriter):
+    """
+    Writer used by insert_dataset.py to load a refreshed file again. The reviews are
+    matched with the ones already stored by their natural key: the new ones are inserted,
+    the changed ones are updated keeping their id, and the unchanged ones are not written
+    to SQL. MongoDB receives an UpdateOne with upsert for every review, since its documents
+    have fields that SQL does not (the text, the summary...) and an identical document is
+    left untouched. The reviews must be added with add_row followed by add_document
+
+    Args:
+        cursor: cursor of the SQL connection used for the load
+        collection: MongoDB collection where the documents are inserted
+        sql_insertions (dict): parameterized INSERT query of each table
+        batch_size (int, optional): rows kept in each buffer before writing them.
+                                    Defaults to TAMANO_LOTE.
+        aggregates (Aggregates, optional): summaries where the inserted and updated
+                                           reviews are counted. Defaults to None.
+        shared_cursor (optional): cursor of a connection in autocommit mode where the
+                                  reviewers and products are written. Defaults to None.
+    """
+
+    # The type is part of the key because the same asin can be in several categories
+    NATURAL_KEY = ["reviewerID", "asin", "type", "unixReviewTime"]
+    # Columns of review that can change in a refreshed file
+    UPDATABLE = ["overall", "reviewTime"]
+
+    def __init__(
+        self,
+        cursor,
+        collection,
+        sql_insertions,
+        batch_size=None,
+        aggregates=None,
+        shared_cursor=None,
+    ):
+        super().__init__(cursor, collection, sql_insertions, batch_size, shared_cursor)
+        self.aggregates = aggregates
+        guide = c.GUIAS_TABLAS_SQL["review"]
+        self.id_position = guide.index("id")
+        self.type_position = guide.index("type")
+        self.key_positions = [guide.index(column) for column in self.NATURAL_KEY]
+        self.update_positions = [guide.index(column) for column in self.UPDATABLE]
+        self.sql_upsert = (
+            sql_insertions["review"].rstrip().rstrip(";")
+            + " ON DUPLICATE KEY UPDATE "
+            + ", ".join(f"{column} = VALUES({column})" for column in self.UPDATABLE)
+            + ";"
+        )
+        self.reviews = {}
+        self.counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+
+        self.create_natural_key()
+        # The documents are updated by id
+        self.collection.create_index("id")
+
+    def create_natural_key(self):
+        """
+        Adds the unique index of the natural key to review if it does not exist
+
+        Raises:
+            Exception: if stored reviews share a natural key, since they cannot be matched
+        """
+        self.cursor.execute(
+            """SELECT COUNT(*)
+                FROM information_schema.statistics
+                WHERE table_schema = DATABASE()
+                    AND table_name = 'review'
+                    AND index_name = 'uq_review_natural';"""
+        )
+        if self.cursor.fetchone()[0]:
+            return
+        key = ", ".join(self.NATURAL_KEY)
+        try:
+            self.cursor.execute(
+                f"""ALTER TABLE review
+                    ADD UNIQUE INDEX uq_review_natural ({key});"""
+            )
+        except pymysql.err.IntegrityError:
+            self.cursor.execute(
+                f"""SELECT {key}, COUNT(*)
+                    FROM review
+                    GROUP BY {key}
+                    HAVING COUNT(*) > 1
+                    LIMIT 5;"""
+            )
+            duplicates = "\n".join(str(row) for row in self.cursor.fetchall())
+            raise Exception(
+                f"The stored reviews have repeated natural keys ({key}), so they cannot "
+                f"be matched with the file and --upsert cannot be used. Some of them, "
+                f"with their count:\n{duplicates}"
+            )
+
+    def add_row(self, table_name, row):
+        """
+        Adds a row to the buffer of a table. The reviews are kept by natural key, so if a
+        review appears twice in the file only its last version is written
+
+        Args:
+            table_name (str): name of the table
+            row (list): values of the row in the order of the table guide
+        """
+        if table_name != "review":
+            super().add_row(table_name, row)
+            return
+        key = tuple(row[i] for i in self.key_positions)
+        if None in key:
+            # Without a complete key it cannot be matched, so it is always a new review
+            key = (None, row[self.id_position])
+        self.last_key = key
+        self.reviews[key] = [row, None]
+
+    def add_document(self, document):
+        """
+        Adds the document of the last review added
+
+        Args:
+            document (dict): the document to insert
+        """
+        self.reviews[self.last_key][1] = document
+        if len(self.reviews) >= self.batch_size:
+            self.flush()
+
+    def same_values(self, stored_values, new_values) -> bool:
+        """
+        Checks if the updatable columns of a stored review are equal to the new ones.
+        They are compared by their type, since MySQL returns the rating as an int and
+        the date as a date while the file has a float and a year-month-day text
+
+        Args:
+            stored_values (tuple): the values read from review
+            new_values (list): the values of the file
+
+        Returns:
+            bool: True if the review did not change
+        """
+        for column, stored, new in zip(self.UPDATABLE, stored_values, new_values):
+            if stored is None or new is None:
+                if stored is not new:
+                    return False
+            elif column == "overall":
+                if int(float(stored)) != int(float(new)):
+                    return False
+            elif str(stored) != str(new):
+                return False
+        return True
+
+    def find_existing(self, keys):
+        """
+        Looks for the stored reviews with the given natural keys
+
+        Args:
+            keys (list): natural keys of the reviews
+
+        Returns:
+            dict: the id and updatable columns of each stored review, by natural key
+        """
+        keys = [key for key in keys if None not in key]
+        if not keys:
+            return {}
+        n_key = len(self.NATURAL_KEY)
+        placeholders = ", ".join(["(" + ", ".join(["%s"] * n_key) + ")"] * len(keys))
+        self.cursor.execute(
+            f"""SELECT {", ".join(self.NATURAL_KEY + ["id"] + self.UPDATABLE)}
+                FROM review
+                WHERE ({", ".join(self.NATURAL_KEY)}) IN ({placeholders});""",
+            [value for key in keys for value in key],
+        )
+        return {
+            tuple(row[:n_key]): (row[n_key], row[n_key + 1 :])
+            for row in self.cursor.fetchall()
+        }
+
+    def flush(self):
+        """Writes the reviewers and products and then upserts the reviews."""
+        self.flush_sql()
+        if not self.reviews:
+            return
+
+        existing = self.find_existing(list(self.reviews))
+        rows = []
+        operations = []
+        for key, (row, document) in self.reviews.items():
+            if key in existing:
+                stored_id, stored_values = existing[key]
+                # The stored review keeps its id in both databases
+                row[self.id_position] = stored_id
+                document["id"] = stored_id
+                new_values = [row[i] for i in self.update_positions]
+                if self.same_values(stored_values, new_values):
+                    # SQL is not written, but MongoDB is, since its fields may have changed
+                    self.counts["unchanged"] += 1
+                else:
+                    self.counts["updated"] += 1
+                    rows.append(row)
+                    if self.aggregates is not None:
+                        # The stored version leaves the summaries and the new one enters.
+                        # The stored text is not known, so the word frequencies are kept
+                        stored_row = list(row)
+                        for i, value in zip(self.update_positions, stored_values):
+                            stored_row[i] = value
+                        self.aggregates.add(stored_row, -1)
+                        self.aggregates.add(row)
+            else:
+                self.counts["inserted"] += 1
+                rows.append(row)
+                if self.aggregates is not None:
+                    self.aggregates.add(row)
+                    self.aggregates.add_terms(
+                        row[self.type_position], document["summary"]
+                    )
+            operations.append(
+                UpdateOne({"id": document["id"]}, {"$set": document}, upsert=True)
+            )
+        self.reviews = {}
+
+        t = perf_counter()
+        if rows:
+            self.cursor.executemany(self.sql_upsert, rows)
+        t = perf_counter() - t
+        self.stats["review"]["time"] += t
+        PROFILER.record("sql_insert", t)
+        self.stats["review"]["rows"] += len(rows)
+
+        t = perf_counter()
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        t = perf_counter() - t
+        self.stats["mongodb"]["time"] += t
+        PROFILER.record("mongodb_insert", t)
+        self.stats["mongodb"]["rows"] += len(operations)
+
+    def report(self):
+        """Prints the rows written per second by each sink and the upsert counts."""
+        super().report()
+        print(
+            f"reviews: {self.counts['inserted']} inserted, {self.counts['updated']} "
+            f"updated, {self.counts['unchanged']} unchanged in SQL"
+        )
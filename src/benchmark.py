@@ -0,0 +1,199 @@
+"""
+================
+benchmark.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file measures the load of load_data.py with each loading mode on synthetic files
+made by generate_data.py. Every mode runs in its own process against scratch databases,
+and the rows per second, peak memory and time of each sink and of each stage of the load
+are written as JSON so the results can be compared between versions.
+
+Regarding the configuration parameters, the databases are NOMBRE_BASE_SQL_BENCHMARK and
+NOMBRE_BASE_MONGODB_BENCHMARK (they are dropped and created again) and the files are
+written in DIRECTORIO_BENCHMARK.
+"""
+
+import config as c
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from time import perf_counter
+from generate_data import generate_files
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+    import psutil
+
+# Configuration parameters changed by each mode
+MODES = {
+    "row": {"TAMANO_LOTE": 1},
+    "batch": {},
+    "parallel": {"PROCESOS_INGESTA": None},
+    "infile": {"MODO_CARGA": "infile"},
+    "fast": {"CARGA_RAPIDA": True},
+    "pipeline": {"MODO_TUBERIA": True},
+    "disk_index": {"INDICE_EN_DISCO": True},
+    "partitioned": {"PARTICIONAR_RESENAS": True},
+}
+
+
+def peak_memory() -> int:
+    """
+    Returns the peak resident memory of this process and its finished children. On Windows
+    the children are not measured, since only the peak of a running process can be read
+
+    Returns:
+        int: peak memory in bytes
+    """
+    if resource is None:
+        return psutil.Process().memory_info().peak_wset
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if platform.system() == "Darwin" else 1024
+    return unit * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+def run_mode(mode: str, directory: str, files: list, extra_file: str = None) -> dict:
+    """
+    Loads the files with a mode and measures it. It changes the configuration of this
+    process, so it must run in a process of its own
+
+    Args:
+        mode (str): name of the mode in MODES
+        directory (str): directory of the synthetic files
+        files (list): names of the files loaded by load_data
+        extra_file (str, optional): file added afterwards with insert_dataset. Defaults to None.
+
+    Returns:
+        dict: rows, seconds, rows per second, sink times and stage times of each step, and
+             peak memory
+    """
+    # The loaders read the configuration when they run, so it is changed before importing them
+    for name, value in MODES[mode].items():
+        setattr(c, name, value)
+    c.NOMBRE_BASE_SQL = c.NOMBRE_BASE_SQL_BENCHMARK
+    c.NOMBRE_BASE_MONGODB = c.NOMBRE_BASE_MONGODB_BENCHMARK
+    c.DIRECTORIO_DATOS = directory
+    c.NOMBRE_FICHEROS_DATOS = files
+    scratch = tempfile.mkdtemp(prefix="benchmark_")
+    c.FICHERO_INDICE_DEDUP = os.path.join(scratch, "dedup_index.pkl")
+    c.FICHERO_INDICE_REVIEWERS = os.path.join(scratch, "reviewers.sqlite")
+    # The time of each stage is measured too, without cProfile, which would slow the load
+    c.PERFILADO = True
+    c.PERFIL_CPROFILE = False
+    c.FICHERO_PERFIL = os.path.join(scratch, "profile.json")
+
+    from load_data import load_data
+    from insert_dataset import insert_dataset
+    from profiler import PROFILER
+
+    steps = [("load_data", load_data, ())]
+    if extra_file:
+        steps.append(("insert_dataset", insert_dataset, (extra_file,)))
+
+    result = {"mode": mode, "config": MODES[mode]}
+    for step, function, args in steps:
+        t = perf_counter()
+        stats = function(*args)
+        seconds = perf_counter() - t
+        reviews = stats.get("review", {}).get("rows", 0)
+        result[step] = {
+            "reviews": reviews,
+            "seconds": seconds,
+            "reviews_per_second": reviews / seconds if seconds else 0,
+            "sinks": stats,
+            # The profiler is reset by each loader, so it only has the stages of this step
+            "stages": PROFILER.summary(),
+        }
+    result["peak_memory"] = peak_memory()
+    return result
+
+
+def run_benchmark(modes: list, scale: float, n_files: int, skew: float) -> dict:
+    """
+    Generates the synthetic files and measures each mode in a new process
+
+    Args:
+        modes (list): names of the modes to measure
+        scale (float): scale factor of the files
+        n_files (int): number of files loaded by load_data (one more is used for insert_dataset)
+        skew (float): exponent of the Zipf distribution of reviewers and products
+
+    Returns:
+        dict: the parameters and the results of each mode
+    """
+    directory = os.path.join(c.DIRECTORIO_BENCHMARK, f"scale_{scale}_skew_{skew}")
+    files = generate_files(directory, n_files + 1, scale, skew)
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "scale": scale,
+        "files": n_files,
+        "skew": skew,
+        "reviews_per_file": int(c.BASE_RESENAS_BENCHMARK * scale),
+        "results": [],
+    }
+    for mode in modes:
+        print(f"*** {mode} ***")
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            subprocess.run(
+                [
+                    sys.executable,
+                    os.path.abspath(__file__),
+                    "--run",
+                    mode,
+                    "--directory",
+                    directory,
+                    "--output",
+                    output.name,
+                    *files,
+                ],
+                check=True,
+            )
+            report["results"].append(json.load(output))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the loading modes")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--scale", type=float, default=c.ESCALA_BENCHMARK)
+    parser.add_argument("--files", type=int, default=c.FICHEROS_BENCHMARK)
+    parser.add_argument("--skew", type=float, default=c.SESGO_BENCHMARK)
+    parser.add_argument("--output", help="JSON file of the results")
+    # Used by run_benchmark to measure a single mode in a new process
+    parser.add_argument("--run", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    parser.add_argument("names", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        result = run_mode(args.run, args.directory, args.names[:-1], args.names[-1])
+        with open(args.output, "w") as f:
+            json.dump(result, f)
+    else:
+        report = run_benchmark(args.modes, args.scale, args.files, args.skew)
+        output = args.output or os.path.join(
+            c.DIRECTORIO_BENCHMARK,
+            f"results_{report['timestamp'].replace(':', '')}.json",
+        )
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        for result in report["results"]:
+            print(
+                f"{result['mode']}: {result['load_data']['reviews_per_second']:.0f} "
+                f"reviews/s, peak memory {result['peak_memory'] / 2**20:.0f} MiB"
+            )
+        print(f"Results written to {output}")
@@ -0,0 +1,174 @@
+"""
+================
+bulk_load.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the writer used by load_data.py when MODO_CARGA is "infile". The rows of
+each table are streamed to temporary TSV files that are loaded with LOAD DATA LOCAL INFILE,
+and the MongoDB documents are loaded with mongoimport if it is installed.
+
+Regarding the configuration parameters, the MySQL server must have local_infile enabled.
+"""
+
+import config as c
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from time import perf_counter
+from batch_writer import BatchWriter
+from profiler import PROFILER
+
+# Characters that LOAD DATA needs escaped with the default FIELDS ESCAPED BY '\\'
+TSV_ESCAPES = str.maketrans(
+    {"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"}
+)
+
+
+def tsv_value(value) -> str:
+    """
+    Converts a value to its representation in the TSV files
+
+    Args:
+        value: the value of a field
+
+    Returns:
+        str: the escaped value, \\N for NULL
+    """
+    if value is None:
+        return "\\N"
+    return str(value).translate(TSV_ESCAPES)
+
+
+def create_sql_load(table_name: str, guide: list) -> str:
+    """Returns an SQL query to load a TSV file into the 'table_name' table,
+    whose columns follow the 'guide' structure.
+
+    Args:
+        table_name (str): name of the table to which the data is to be loaded.
+        guide (list): names of the table fields
+
+    Returns:
+        str: SQL query with the path of the file as parameter
+    """
+    return f"""LOAD DATA LOCAL INFILE %s
+            INTO TABLE {table_name}
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+            LINES TERMINATED BY '\\n'
+            ({", ".join(guide)});
+    """
+
+
+class InfileWriter(BatchWriter):
+    """
+    Writer with the same interface as BatchWriter that streams the rows to one TSV file
+    per table and loads them with LOAD DATA LOCAL INFILE on each flush. The connection
+    of the cursor must be opened with local_infile=True
+
+    Args:
+        cursor: cursor of the SQL connection used for the load
+        collection: MongoDB collection where the documents are inserted
+        sql_insertions (dict): parameterized INSERT query of each table, only its keys are used
+        batch_size (int, optional): documents per insert_many when mongoimport is not
+                                    available. Defaults to TAMANO_LOTE.
+    """
+
+    def __init__(self, cursor, collection, sql_insertions, batch_size=None):
+        super().__init__(cursor, collection, sql_insertions, batch_size)
+        self.sql_loads = {
+            table_name: create_sql_load(table_name, c.GUIAS_TABLAS_SQL[table_name])
+            for table_name in sql_insertions
+        }
+        self.files = {table_name: None for table_name in sql_insertions}
+        self.row_counts = {table_name: 0 for table_name in sql_insertions}
+
+        # Without mongoimport the documents are sent with insert_many as in BatchWriter
+        self.mongoimport = shutil.which("mongoimport")
+        self.documents_file = None
+        self.document_count = 0
+
+    @staticmethod
+    def open_file(suffix: str):
+        """Opens a new temporary file where the rows are written."""
+        return tempfile.NamedTemporaryFile(
+            "w", suffix=suffix, encoding="utf-8", newline="", delete=False
+        )
+
+    def add_row(self, table_name, row):
+        """
+        Writes a row to the TSV file of a table
+
+        Args:
+            table_name (str): name of the table
+            row (list): values of the row in the order of the table guide
+        """
+        if self.files[table_name] is None:
+            self.files[table_name] = self.open_file(".tsv")
+        self.files[table_name].write("\t".join(tsv_value(v) for v in row) + "\n")
+        self.row_counts[table_name] += 1
+
+    def add_document(self, document):
+        """
+        Writes a document to the JSON lines file read by mongoimport
+
+        Args:
+            document (dict): the document to insert
+        """
+        if not self.mongoimport:
+            super().add_document(document)
+            return
+        if self.documents_file is None:
+            self.documents_file = self.open_file(".json")
+        self.documents_file.write(json.dumps(document) + "\n")
+        self.document_count += 1
+
+    def flush_sql(self):
+        """
+        Loads the TSV files in the order of GUIAS_TABLAS_SQL and deletes them
+        """
+        for table_name, f in self.files.items():
+            if f is None:
+                continue
+            f.close()
+            t = perf_counter()
+            self.cursor.execute(self.sql_loads[table_name], f.name)
+            t = perf_counter() - t
+            self.stats[table_name]["time"] += t
+            PROFILER.record("sql_insert", t)
+            self.stats[table_name]["rows"] += self.row_counts[table_name]
+            os.remove(f.name)
+            self.files[table_name] = None
+            self.row_counts[table_name] = 0
+
+    def flush_mongodb(self):
+        """Loads the JSON lines file with mongoimport and deletes it."""
+        if not self.mongoimport:
+            super().flush_mongodb()
+            return
+        if self.documents_file is None:
+            return
+        self.documents_file.close()
+        t = perf_counter()
+        subprocess.run(
+            [
+                self.mongoimport,
+                "--uri=mongodb://localhost:27017",
+                f"--db={c.NOMBRE_BASE_MONGODB}",
+                f"--collection={c.NOMBRE_TABLA_MONGODB}",
+                f"--file={self.documents_file.name}",
+                f"--numInsertionWorkers={os.cpu_count()}",
+                "--quiet",
+            ],
+            check=True,
+        )
+        t = perf_counter() - t
+        self.stats["mongodb"]["time"] += t
+        PROFILER.record("mongodb_insert", t)
+        self.stats["mongodb"]["rows"] += self.document_count
+        os.remove(self.documents_file.name)
+        self.documents_file = None
+        self.document_count = 0
@@ -0,0 +1,218 @@
+"""
+================
+check_query_plans.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file checks the plans of the SQL queries of dashboard.py and neo4Jdb.py. The queries
+are read from the source of the files, so a new query is checked without adding it here,
+and each one is run with EXPLAIN on the loaded database. It fails if a query reads a whole
+table or sorts its rows with a filesort, unless it is one of the ALLOWED cases, so an index
+that is dropped or a query that stops using one is noticed before it reaches the dashboard.
+The plans depend on the data, so it must be run on a loaded database.
+
+Regarding the configuration parameters, there are none.
+"""
+
+import ast
+import os
+import re
+import sys
+import config as c
+import pymysql
+
+FILES = ["dashboard.py", "neo4Jdb.py"]
+
+# Value of each %s of the queries, chosen by the text before it
+PARAMETERS = [
+    (re.compile(r"\btype\s+in\s*$", re.IGNORECASE), "types"),
+    (re.compile(r"\basin\s+in\s*$", re.IGNORECASE), "asins"),
+    (re.compile(r"\btype\s*=\s*$", re.IGNORECASE), "type"),
+    (re.compile(r"\blike\s*$", re.IGNORECASE), "prefix"),
+    (re.compile(r"(\blimit|/)\s*$", re.IGNORECASE), "number"),
+]
+
+# (query, table, problem): why it cannot be avoided. The queries are named by the id of the
+# graph of their callback, or by their function
+ALLOWED = {
+    ("graph-2", "agg_rating", "filesort"): "the products are sorted by their reviews",
+    ("graph-3", "agg_rating", "filesort"): "one row per rating, from two indexes",
+    ("graph-4", "review", "filesort"): "the buckets are sorted after grouping",
+    ("get_users_and_types", "reviewer", "filesort"): "reviewerName is TEXT",
+    ("popular_articles", "review", "filesort"): "sorted by reviews per product",
+}
+
+
+def query_name(function) -> str:
+    """
+    Returns the name of the queries of a function: the id of the output of its callback,
+    or the name of the function
+
+    Args:
+        function (ast.FunctionDef): the function
+
+    Returns:
+        str: the name
+    """
+    for decorator in function.decorator_list:
+        if isinstance(decorator, ast.Call):
+            for argument in decorator.args:
+                if isinstance(argument, ast.Call):
+                    for keyword in argument.keywords:
+                        if keyword.arg == "component_id":
+                            return keyword.value.value
+    return function.name
+
+
+def find_queries(path) -> list:
+    """
+    Finds the SQL queries of a file: the strings that start with SELECT
+
+    Args:
+        path (str): the Python file
+
+    Returns:
+        list: (name, query) of each query, numbered if a function has more than one
+    """
+    with open(path, encoding="utf-8") as file:
+        tree = ast.parse(file.read())
+    queries = []
+    for function in ast.walk(tree):
+        if not isinstance(function, ast.FunctionDef):
+            continue
+        found = [
+            node.value
+            for node in ast.walk(function)
+            if isinstance(node, ast.Constant)
+            and isinstance(node.value, str)
+            and node.value.lstrip().upper().startswith("SELECT")
+        ]
+        name = query_name(function)
+        for i, sql in enumerate(found):
+            queries.append((f"{name}#{i + 1}" if len(found) > 1 else name, sql))
+    return queries
+
+
+def sample_values(cursor) -> dict:
+    """
+    Returns the values given to the parameters of the queries, taken from the database
+
+    Args:
+        cursor: cursor of the SQL connection
+
+    Returns:
+        dict: value of each kind of parameter of PARAMETERS
+    """
+    cursor.execute("SELECT DISTINCT type FROM product;")
+    types = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT asin FROM product LIMIT 5;")
+    asins = [row[0] for row in cursor.fetchall()]
+    if not types:
+        raise Exception("The database is empty, the plans would not be the real ones")
+    return {
+        "types": types,
+        "asins": asins,
+        "type": types[0],
+        "prefix": asins[0][:1] + "%",
+        "number": 10,
+    }
+
+
+def query_parameters(name, sql, values) -> list:
+    """
+    Returns the values of the %s of a query
+
+    Args:
+        name (str): the name of the query
+        sql (str): the query
+        values (dict): the values of each kind of parameter
+
+    Returns:
+        list: the value of each %s
+
+    Raises:
+        Exception: if the kind of a parameter is not in PARAMETERS
+    """
+    parameters = []
+    for placeholder in re.finditer(r"%s", sql):
+        before = sql[: placeholder.start()]
+        for pattern, kind in PARAMETERS:
+            if pattern.search(before):
+                parameters.append(values[kind])
+                break
+        else:
+            raise Exception(f"{name}: unknown parameter after '{before[-30:].strip()}'")
+    return parameters
+
+
+def plan_problems(name, plan) -> list:
+    """
+    Returns the problems of the plan of a query that are not allowed
+
+    Args:
+        name (str): the name of the query
+        plan (list): the rows of EXPLAIN as dicts
+
+    Returns:
+        list: (problem, table) of each one
+    """
+    problems = []
+    for row in plan:
+        table = row["table"] or ""
+        # The derived tables are the results of subqueries, they have no indexes
+        if row["type"] == "ALL" and not table.startswith("<"):
+            problems.append(("full scan", table))
+        if "Using filesort" in (row["Extra"] or ""):
+            problems.append(("filesort", table))
+    return [
+        (problem, table)
+        for problem, table in problems
+        if (name.split("#")[0], table, problem) not in ALLOWED
+    ]
+
+
+def check_query_plans(cursor) -> int:
+    """
+    Runs EXPLAIN on each query of FILES and prints its problems
+
+    Args:
+        cursor: cursor of the SQL connection
+
+    Returns:
+        int: number of queries with problems
+    """
+    values = sample_values(cursor)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    failed = 0
+    for file in FILES:
+        for name, sql in find_queries(os.path.join(directory, file)):
+            parameters = query_parameters(name, sql, values)
+            cursor.execute("EXPLAIN " + cursor.mogrify(sql, parameters or None))
+            columns = [column[0] for column in cursor.description]
+            plan = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            problems = plan_problems(name, plan)
+            if problems:
+                failed += 1
+                for problem, table in problems:
+                    print(f"FAIL {file} {name}: {problem} of {table}")
+            else:
+                print(f"OK   {file} {name}")
+    return failed
+
+
+if __name__ == "__main__":
+    mysql_connection = pymysql.connect(
+        host="localhost",
+        user=c.USUARIO_SQL,
+        password=c.PASSWORD_SQL,
+        database=c.NOMBRE_BASE_SQL,
+    )
+
+    with mysql_connection:
+        cursor = mysql_connection.cursor()
+        failed = check_query_plans(cursor)
+        cursor.close()
+    if failed:
+        print(f"{failed} queries without a proper index plan")
+        sys.exit(1)
@@ -0,0 +1,128 @@
+"""
+================
+checkpoint.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file saves the progress of load_data.py and insert_dataset.py in SQL. Each checkpoint
+stores the file, the byte offset reached and the next review id (with the end of its id
+block when the ids come from id_allocator.py), and it is committed in the
+same transaction as the rows it covers, so a load can be resumed from it with --resume.
+
+Regarding the configuration parameters, the frequency is set with TROZOS_POR_CHECKPOINT.
+"""
+
+import os
+
+
+SQL_CHECKPOINT_TABLE = """
+    CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+        file VARCHAR(255) NOT NULL,
+        byte_offset BIGINT NOT NULL,
+        next_id INT NOT NULL,
+        end_id INT,
+        PRIMARY KEY (file)
+    );"""
+
+
+def create_checkpoint_table(cursor) -> None:
+    """
+    Creates the checkpoint table if it does not exist
+
+    Args:
+        cursor: cursor of the SQL connection
+    """
+    cursor.execute(SQL_CHECKPOINT_TABLE)
+
+
+def get_checkpoint(cursor, file_name: str):
+    """
+    Returns the last checkpoint saved for a file
+
+    Args:
+        cursor: cursor of the SQL connection
+        file_name (str): name of the data file
+
+    Returns:
+        tuple: the byte offset, the next review id and the end of its id block,
+               or None if there is no checkpoint
+    """
+    cursor.execute(
+        "SELECT byte_offset, next_id, end_id FROM ingest_checkpoint WHERE file = %s;",
+        file_name,
+    )
+    return cursor.fetchone()
+
+
+def get_next_id(cursor) -> int:
+    """
+    Returns the next review id after all the checkpoints saved, which is where a
+    load of several files has to be resumed
+
+    Args:
+        cursor: cursor of the SQL connection
+
+    Returns:
+        int: the next review id, 1 if there are no checkpoints
+    """
+    cursor.execute("SELECT MAX(next_id) FROM ingest_checkpoint;")
+    return cursor.fetchone()[0] or 1
+
+
+def is_finished(checkpoint, path: str) -> bool:
+    """
+    Checks if a checkpoint covers the whole file
+
+    Args:
+        checkpoint (tuple): the checkpoint returned by get_checkpoint
+        path (str): path of the data file
+
+    Returns:
+        bool: whether the file was completely loaded
+    """
+    return checkpoint is not None and checkpoint[0] >= os.path.getsize(path)
+
+
+def save_checkpoint(file_name: str, offset: int, next_id: int, end_id=None):
+    """
+    Returns a function that saves a checkpoint with the given cursor. It is passed to
+    the commit of the writer so the checkpoint goes in the same transaction as the rows
+
+    Args:
+        file_name (str): name of the data file
+        offset (int): byte offset up to which the file has been loaded
+        next_id (int): id of the next review
+        end_id (int, optional): first id after the block reserved for the next reviews.
+                                Defaults to None (ids are not reserved in blocks).
+
+    Returns:
+        function: function that receives the cursor and saves the checkpoint
+    """
+
+    def save(cursor):
+        cursor.execute(
+            """REPLACE INTO ingest_checkpoint (file, byte_offset, next_id, end_id)
+                VALUES (%s, %s, %s, %s);""",
+            [file_name, offset, next_id, end_id],
+        )
+
+    return save
+
+
+def discard_uncommitted(collection, first_id: int, end_id=None) -> None:
+    """
+    Deletes the MongoDB documents written after the last checkpoint. The documents are
+    written before each SQL commit, so after a crash MongoDB can be ahead of SQL but
+    never behind it
+
+    Args:
+        collection: MongoDB collection of the reviews
+        first_id (int): first id that was not committed
+        end_id (int, optional): first id after the block of the load, needed when other
+                                loads may be writing after it. Defaults to no limit.
+    """
+    id_filter = {"$gte": first_id}
+    if end_id is not None:
+        id_filter["$lt"] = end_id
+    collection.delete_many({"id": id_filter})
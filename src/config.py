@@ -18,6 +18,28 @@ NOMBRE_FICHEROS_DATOS = [
 ]  # used in load_data.py
 NOMBRE_FICHEROS_EXTRA = "Amazon_Instant_Video_5.json"  # used in inserta_dataset.py
 
+# Loading parameters (used in load_data.py and insert_dataset.py)
+TAMANO_LOTE = 5000  # rows kept in memory per table before writing them to the databases
+PROCESOS_INGESTA = 1  # processes that parse and clean the files (1 = main process, None = every core)
+TAMANO_TROZO = 10000  # lines of a file sent to a process at a time
+TROZOS_POR_CHECKPOINT = 10  # chunks loaded between two commits with checkpoint (--resume)
+MODO_CARGA = "insert"  # load_data.py: "insert" (batched INSERTs) or "infile" (LOAD DATA LOCAL INFILE)
+CARGA_RAPIDA = False  # load_data.py: add the keys and indexes after loading the data
+# load_data.py: one LIST partition of review per product type (review has no foreign keys then)
+PARTICIONAR_RESENAS = False
+# Read the file and write SQL and MongoDB in separate threads (not with "infile" or --upsert)
+MODO_TUBERIA = False
+TAMANO_COLA = 4  # batches waiting between two threads of the pipeline
+FICHERO_INDICE_DEDUP = "data/dedup_index.pkl"  # reviewers and products already loaded
+# Keep the reviewers of the index on disk so the memory does not grow with their number
+INDICE_EN_DISCO = False
+FICHERO_INDICE_REVIEWERS = "data/reviewers.sqlite"
+TAMANO_CACHE_REVIEWERS = 100000  # reviewers of the disk index kept in memory
+PERFILADO = False  # record the time of each stage of the load and report it at the end
+FICHERO_PERFIL = "data/profile.json"
+# Also run the main thread under cProfile (written next to FICHERO_PERFIL, as .prof)
+PERFIL_CPROFILE = False
+
 
 # Required credentials
 USUARIO_SQL = "alfaduck"
@@ -46,6 +68,28 @@ GUIAS_TABLAS_SQL = {
 NOMBRE_BASE_MONGODB = "reviews_product_Mongo"
 NOMBRE_TABLA_MONGODB = "review"
 GUIA_TABLA_MONGODB = ["id", "reviewText", "summary", "helpful"]
+# Fields of review also copied to the MongoDB documents, so they can be filtered without
+# SQL (an empty list keeps only GUIA_TABLA_MONGODB). Existing documents are filled by
+# running mongodb_fields.py
+CAMPOS_DESNORMALIZADOS_MONGODB = ["type", "asin", "overall", "unixReviewTime"]
+
+# SQL connection pool (used in dashboard.py and neo4Jdb.py)
+TAMANO_MIN_POOL_SQL = 1  # connections opened at the start
+TAMANO_MAX_POOL_SQL = 8
+ESPERA_POOL_SQL = 30  # seconds a query waits for a free connection
+
+# Dashboard
+TAMANO_CACHE_CONSULTAS = 256  # query results kept in memory
+TTL_CACHE_CONSULTAS = 600  # seconds a query result is reused
+PUNTOS_GRAFICA_EVOLUCION = 1000  # points of the review evolution chart (graph-4)
+PALABRAS_NUBE = 200  # words of the word cloud (graph-6)
+SUGERENCIAS_ASIN = 20  # products shown while an asin is typed in dropdown-3
+# Statistics of the layout, reused while the version of the data does not change
+FICHERO_SNAPSHOT_DASHBOARD = "data/dashboard_stats.json"
+# SQL queries slower than UMBRAL_CONSULTA_LENTA seconds are written to this file as JSON
+# lines (None = not written). The rest of the metrics are in the /metrics route
+FICHERO_CONSULTAS_LENTAS = None
+UMBRAL_CONSULTA_LENTA = 0.5
 
 # Neo4J URI
 URI = "neo4j://localhost:7687"
@@ -55,3 +99,13 @@ N_USUARIOS_NEO = 30
 EJERCICIO = 3
 CAT_EJERCICIO_2 = "Video_Games_5"
 N_USUARIOS_NEO_EJ3 = 400
+
+# Benchmark (used in generate_data.py and benchmark.py)
+DIRECTORIO_BENCHMARK = "benchmark"  # synthetic files and results
+BASE_RESENAS_BENCHMARK = 100000  # reviews per file with scale 1
+ESCALA_BENCHMARK = 1.0
+FICHEROS_BENCHMARK = 4
+SESGO_BENCHMARK = 1.0  # Zipf exponent of reviewers and products (0 = uniform)
+# The benchmark loads into these databases, so the real ones are not touched
+NOMBRE_BASE_SQL_BENCHMARK = "reviews_product_SQL_benchmark"
+NOMBRE_BASE_MONGODB_BENCHMARK = "reviews_product_Mongo_benchmark"
@@ -0,0 +1,234 @@
+"""
+================
+connection_pool.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the pool of MySQL connections shared by dashboard.py and neo4Jdb.py.
+The connections are opened once and reused by the queries, instead of connecting to the
+server for each one, and a connection that stopped working is opened again when it is taken.
+
+Regarding the configuration parameters, the size of the pool is set with
+TAMANO_MIN_POOL_SQL and TAMANO_MAX_POOL_SQL and the seconds a query waits for a free
+connection with ESPERA_POOL_SQL.
+"""
+
+import config as c
+import pymysql
+from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from threading import Lock
+from time import perf_counter
+
+
+class ConnectionPool:
+    """
+    Pool of autocommit connections to the SQL database. Each query sees the data committed
+    before it, as with a new connection. The times waited for a connection are recorded
+
+    Args:
+        min_size (int, optional): connections opened at the start. Defaults to TAMANO_MIN_POOL_SQL.
+        max_size (int, optional): maximum connections open. Defaults to TAMANO_MAX_POOL_SQL.
+        timeout (float, optional): seconds to wait for a free connection. Defaults to ESPERA_POOL_SQL.
+        database (str, optional): the SQL database. Defaults to NOMBRE_BASE_SQL.
+    """
+
+    def __init__(self, min_size=None, max_size=None, timeout=None, database=None):
+        self.min_size = c.TAMANO_MIN_POOL_SQL if min_size is None else min_size
+        self.max_size = max_size or c.TAMANO_MAX_POOL_SQL
+        self.timeout = timeout or c.ESPERA_POOL_SQL
+        self.database = database or c.NOMBRE_BASE_SQL
+        self.lock = Lock()
+        # The last connection returned is reused first, so the others can be closed by the server
+        self.idle = LifoQueue()
+        self.stats = {
+            "checkouts": 0,
+            "created": 0,
+            "reconnects": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+        for _ in range(self.min_size):
+            self.idle.put(self.connect())
+        self.size = self.min_size
+
+    def connect(self):
+        """
+        Opens a new connection
+
+        Returns:
+            Connection: the new connection
+        """
+        connection = pymysql.connect(
+            host="localhost",
+            user=c.USUARIO_SQL,
+            password=c.PASSWORD_SQL,
+            database=self.database,
+            autocommit=True,
+        )
+        with self.lock:
+            self.stats["created"] += 1
+        return connection
+
+    def discard(self, connection):
+        """
+        Closes a connection that must not be reused and frees its place in the pool
+
+        Args:
+            connection (Connection): the connection
+        """
+        with self.lock:
+            self.size -= 1
+        try:
+            connection.close()
+        except pymysql.err.Error:
+            pass
+
+    def check(self, connection):
+        """
+        Checks that a connection still works, and connects it again if it does not
+        (e.g. the server closed it after being idle)
+
+        Args:
+            connection (Connection): the connection
+        """
+        try:
+            connection.ping(reconnect=False)
+        except pymysql.err.Error:
+            try:
+                connection.connect()
+            except pymysql.err.Error:
+                self.discard(connection)
+                raise
+            with self.lock:
+                self.stats["reconnects"] += 1
+
+    def acquire(self):
+        """
+        Takes a connection from the pool, opening a new one if none is free and the pool
+        is not full, or waiting for one otherwise. The connection is checked before
+        returning it
+
+        Returns:
+            Connection: a working connection
+
+        Raises:
+            Exception: if no connection is released within the timeout
+        """
+        t = perf_counter()
+        try:
+            connection = self.idle.get_nowait()
+        except Empty:
+            with self.lock:
+                # The place is taken before connecting, so the pool never exceeds max_size
+                can_open = self.size < self.max_size
+                if can_open:
+                    self.size += 1
+            if can_open:
+                try:
+                    connection = self.connect()
+                except pymysql.err.Error:
+                    with self.lock:
+                        self.size -= 1
+                    raise
+            else:
+                try:
+                    connection = self.idle.get(timeout=self.timeout)
+                except Empty:
+                    raise Exception(
+                        f"No SQL connection was released in {self.timeout} s"
+                    )
+        self.check(connection)
+
+        wait = perf_counter() - t
+        with self.lock:
+            self.stats["checkouts"] += 1
+            self.stats["wait_total"] += wait
+            self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+        return connection
+
+    def release(self, connection):
+        """
+        Returns a connection to the pool
+
+        Args:
+            connection (Connection): the connection taken with acquire
+        """
+        self.idle.put(connection)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that takes a connection and returns it to the pool at the end. If
+        the connection fails it is closed instead, and its place is taken by a new one
+
+        Yields:
+            Connection: a working connection
+        """
+        connection = self.acquire()
+        try:
+            yield connection
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            self.discard(connection)
+            raise
+        except BaseException:
+            # The transaction of the failed query is not left open for the next user
+            try:
+                connection.rollback()
+                self.release(connection)
+            except pymysql.err.Error:
+                self.discard(connection)
+            raise
+        else:
+            self.release(connection)
+
+    def close(self):
+        """Closes the free connections."""
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except Empty:
+                return
+
+    def summary(self) -> dict:
+        """
+        Returns the use of the pool
+
+        Returns:
+            dict: the connections open and free and the statistics of the checkouts
+        """
+        with self.lock:
+            return {"size": self.size, "idle": self.idle.qsize(), **self.stats}
+
+    def report(self):
+        """Prints the use of the pool."""
+        average = (
+            self.stats["wait_total"] / self.stats["checkouts"]
+            if self.stats["checkouts"]
+            else 0
+        )
+        print(
+            f"SQL pool: {self.size} connections, {self.stats['checkouts']} checkouts, "
+            f"{self.stats['created']} created, {self.stats['reconnects']} reconnects, "
+            f"wait average {1000 * average:.2f} ms, max {1000 * self.stats['wait_max']:.2f} ms"
+        )
+
+
+# Pool shared by the modules of the process, created on the first use
+pool = None
+pool_lock = Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Returns the pool shared by the process, creating it the first time
+
+    Returns:
+        ConnectionPool: the pool
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ConnectionPool()
+    return pool
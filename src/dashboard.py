@@ -6,6 +6,7 @@ dashboard.py
 Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
 
 This file creates a dashboard with graphs about Amazon review data. It is necessary to run load_data.py before running this.
+The app is created with create_app, and nothing is queried until the first page is loaded.
 
 Regarding the configuration parameters, it is only necessary to ensure that the SQL and MongoDB credentials are correct.
 """
@@ -14,19 +15,33 @@ import dash
 
 from dash import html, dcc, dash_table
 
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import pandas as pd
 import numpy as np
 import plotly.express as px
-from dash import Dash
+from dash import Dash, callback
+from flask import has_request_context
 
 import pymysql
 from pymongo import MongoClient, InsertOne, UpdateOne, ReplaceOne
 import json
 import os
+import re
+from itertools import accumulate
 import config as c
 from wordcloud import WordCloud
 import pandas as pd
+from threading import Lock
+from query_cache import QueryCache
+from connection_pool import get_pool
+from data_version import get_data_version
+from metrics import METRICS, install_metrics
+from time import perf_counter
+
+# Results of the queries, reused until more data is loaded or they expire
+query_cache = QueryCache()
+# Figures that are expensive to render, like the word clouds
+figure_cache = QueryCache()
 
 
 def get_client() -> MongoClient:
@@ -58,6 +73,8 @@ def get_database(database: str):
     return client[database]
 
 
+@METRICS.queries
+@query_cache.cached
 def sql_queries(sql, data=None):
     """
     Function to automate SQL queries to the server
@@ -69,46 +86,119 @@ def sql_queries(sql, data=None):
     Returns:
         list: list of tuples containing the results for each of the requested parameters
     """
-    mysql_connection = pymysql.connect(
-        host="localhost",
-        user=c.USUARIO_SQL,
-        password=c.PASSWORD_SQL,
-        database=c.NOMBRE_BASE_SQL,  # Your user
-    )
-    with mysql_connection:
+    t = perf_counter()
+    # The connection is taken from the pool shared with the other queries
+    with get_pool().connection() as mysql_connection:
         cursor = mysql_connection.cursor()
         if data:
             # If it has parameters, we substitute them in the query
             cursor.execute(sql, data)
         else:
             cursor.execute(sql)
-        data = cursor.fetchall()
-        # Transform the data from rows to columns to better operate on them
-        data = list(zip(*data))
-    return data
-
-
-# SQL connection
-mysql_connection = pymysql.connect(
-    host="localhost",
-    user=c.USUARIO_SQL,
-    password=c.PASSWORD_SQL,
-    database=c.NOMBRE_BASE_SQL,  # Your user
-)
-# Mongo connection
-dbname = get_database(c.NOMBRE_BASE_MONGODB)
-collection = dbname[c.NOMBRE_TABLA_MONGODB]
-# We do some queries beforehand to get the categories and product numbers
-with mysql_connection:
-    cursor = mysql_connection.cursor()
-    sql = """SELECT DISTINCT(type)
-                FROM product"""
-    cursor.execute(sql)
-    product_types = [i[0] for i in cursor.fetchall()]
-    sql = """SELECT DISTINCT(asin)
+        rows = cursor.fetchall()
+    METRICS.query_executed(sql, data, perf_counter() - t, len(rows))
+    # Transform the data from rows to columns to better operate on them
+    return list(zip(*rows))
+
+
+# Statistics used to build the layout, for the last data version seen by this process
+stats_cache = {}
+stats_lock = Lock()
+
+
+def compute_stats(key: list) -> dict:
+    """
+    Queries the product types and the histogram of reviews per user
+
+    Args:
+        key (list): the SQL database, its stamp and the data version they belong to
+
+    Returns:
+        dict: the key, the product types and the users that have each number of reviews
+    """
+    product_types = sql_queries(
+        """SELECT DISTINCT(type)
                 FROM product"""
-    cursor.execute(sql)
-    product_numbers = [i[0] for i in cursor.fetchall()]
+    )
+    # Query to get the number of users in the graph without callback
+    query_users = """SELECT COUNT(*), reviews
+                        FROM agg_reviewer
+                        GROUP BY reviews
+                        ORDER BY reviews
+    """
+    users, n_reviews = sql_queries(query_users) or [[], []]
+    users_by_reviews = dict(zip(n_reviews, users))
+    # Transformation so that the histogram does not group several quantities into a single bin
+    n_reviews = list(range(max(users_by_reviews, default=0) + 1))
+    users = [users_by_reviews.get(n, 0) for n in n_reviews]
+    return {
+        "key": key,
+        "product_types": list(product_types[0]) if product_types else [],
+        "users": users,
+        "n_reviews": n_reviews,
+    }
+
+
+def read_snapshot(key: list):
+    """
+    Reads the statistics saved on disk
+
+    Args:
+        key (list): the SQL database, its stamp and the data version expected
+
+    Returns:
+        dict: the statistics, or None if there are none for that key
+    """
+    try:
+        with open(c.FICHERO_SNAPSHOT_DASHBOARD) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return stats if stats.get("key") == key else None
+
+
+def save_snapshot(stats: dict) -> None:
+    """
+    Saves the statistics on disk, replacing the file at once
+
+    Args:
+        stats (dict): the statistics returned by compute_stats
+    """
+    directory = os.path.dirname(c.FICHERO_SNAPSHOT_DASHBOARD)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{c.FICHERO_SNAPSHOT_DASHBOARD}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(stats, f)
+    os.replace(tmp_path, c.FICHERO_SNAPSHOT_DASHBOARD)
+
+
+def dashboard_stats() -> dict:
+    """
+    Returns the statistics needed to build the layout. They are only computed again when
+    the version of the data changes, and they are kept on disk so a new process can
+    start with them. When the version changes the cached results are discarded too
+
+    Returns:
+        dict: the product types and the histogram of reviews per user
+    """
+    with get_pool().connection() as mysql_connection:
+        stamp, version = get_data_version(mysql_connection.cursor())
+    # The stamp changes when the database is created again, which restarts the version
+    key = [c.NOMBRE_BASE_SQL, stamp, version]
+    with stats_lock:
+        if stats_cache.get("key") != key:
+            query_cache.clear()
+            figure_cache.clear()
+            stats = read_snapshot(key)
+            if stats is None:
+                stats = compute_stats(key)
+                save_snapshot(stats)
+            stats_cache.clear()
+            stats_cache.update(stats)
+        return stats_cache
+
+
 # Dashboard styles
 tabs_styles = {"height": "44px"}
 tab_style = {
@@ -124,23 +214,6 @@ tab_selected_style = {
     "color": "white",
     "padding": "6px",
 }
-# Query to get the number of users in the graph without callback
-# We do it beforehand because the graph does not update
-query_users = """SELECT COUNT(*), num_rev
-                    FROM (SELECT reviewerID, COUNT(*) AS num_rev
-                        FROM review
-                        GROUP BY reviewerID) AS conteo
-                    GROUP BY num_rev
-                    ORDER BY num_rev
-
-"""
-users, n_reviews = sql_queries(query_users)
-# Transformation so that the histogram does not group several quantities into a single bin
-users = [
-    users[n_reviews.index(i)] if i in n_reviews else 0
-    for i in range(max(n_reviews) + 1)
-]
-n_reviews = list(range(max(n_reviews) + 1))
 # Graph styles
 graph_style = {
     "width": "45%",
@@ -149,108 +222,123 @@ graph_style = {
     "padding": "2%",
 }
 
-# Step 1. Create the app
-app = Dash(__name__)
-
-# Step 2. Set the title
-app.title = "Amazon Reviews Visualization Menu"
-
-# Step 3. Set the layout
-
-app.layout = html.Div(
-    [
-        # Title
-        html.H1(
-            "Amazon Reviews Visualization Menu",
-            style={"text-align": "center", "font_family": "sans-serif"},
-        ),
-        # Content
-        # Each div corresponds to a graph and its dropdown. It has to be done this way because otherwise the
-        # dropdowns occupy the entire width of the page
-        html.Div(
-            [
-                dcc.Dropdown(
-                    id="dropdown-1",  ## dropdown menu
-                    options=[{"label": i, "value": i} for i in ["All"] + product_types],
-                    value="All",
-                ),  ## selected state
-                dcc.Graph(id="graph-1"),  # Reviews per year
-            ],
-            style=graph_style,
-        ),
-        html.Div(
-            [
-                dcc.Dropdown(
-                    id="dropdown-2",  ## dropdown menu
-                    options=[{"label": i, "value": i} for i in ["All"] + product_types],
-                    value="All",
-                ),  ## selected state
-                dcc.Graph(id="graph-2"),  # Popularity evolution
-            ],
-            style=graph_style,
-        ),
-        html.Div(
-            [
-                dcc.Dropdown(
-                    id="dropdown-3",  ## dropdown menu
-                    options=[
-                        {"label": i, "value": i}
-                        for i in ["All"] + product_types + product_numbers
-                    ],
-                    value="All",
-                ),  ## selected state
-                dcc.Graph(id="graph-3"),  # Reviews by rating
-            ],
-            style=graph_style,
-        ),
-        html.Div(
-            [
-                dcc.Dropdown(
-                    id="dropdown-4",  ## dropdown menu
-                    options=[{"label": i, "value": i} for i in ["All"] + product_types],
-                    value="All",
-                ),  ## selected state
-                dcc.Graph(id="graph-4"),  # Reviews evolution
-            ],
-            style=graph_style,
-        ),
-        # This graph does not have a dropdown or a callback, it does not update
-        html.Div(
-            dcc.Graph(
-                figure=px.histogram(
-                    x=n_reviews,
-                    y=users,
-                    title="Reviews per user",
-                    nbins=len(users),
+
+def serve_layout():
+    """
+    Builds the layout of the dashboard. Dash calls it on each page load, so the
+    statistics are taken when the page is opened instead of when the module is imported
+    """
+    if has_request_context():
+        stats = dashboard_stats()
+    else:
+        # Dash also calls it when the layout is set, to validate the ids of the callbacks.
+        # The ids do not depend on the data, so the databases are not queried then
+        stats = {"product_types": [], "users": [], "n_reviews": []}
+    product_types = stats["product_types"]
+    users, n_reviews = stats["users"], stats["n_reviews"]
+
+    return html.Div(
+        [
+            # Title
+            html.H1(
+                "Amazon Reviews Visualization Menu",
+                style={"text-align": "center", "font_family": "sans-serif"},
+            ),
+            # Content
+            # Each div corresponds to a graph and its dropdown. It has to be done this way because otherwise the
+            # dropdowns occupy the entire width of the page
+            html.Div(
+                [
+                    dcc.Dropdown(
+                        id="dropdown-1",  ## dropdown menu
+                        options=[
+                            {"label": i, "value": i} for i in ["All"] + product_types
+                        ],
+                        value="All",
+                    ),  ## selected state
+                    dcc.Graph(id="graph-1"),  # Reviews per year
+                ],
+                style=graph_style,
+            ),
+            html.Div(
+                [
+                    dcc.Dropdown(
+                        id="dropdown-2",  ## dropdown menu
+                        options=[
+                            {"label": i, "value": i} for i in ["All"] + product_types
+                        ],
+                        value="All",
+                    ),  ## selected state
+                    dcc.Graph(id="graph-2"),  # Popularity evolution
+                ],
+                style=graph_style,
+            ),
+            html.Div(
+                [
+                    dcc.Dropdown(
+                        id="dropdown-3",  ## dropdown menu
+                        # The asins are added by update_asin_options as they are typed
+                        options=[
+                            {"label": i, "value": i} for i in ["All"] + product_types
+                        ],
+                        value="All",
+                    ),  ## selected state
+                    dcc.Graph(id="graph-3"),  # Reviews by rating
+                ],
+                style=graph_style,
+            ),
+            html.Div(
+                [
+                    dcc.Dropdown(
+                        id="dropdown-4",  ## dropdown menu
+                        options=[
+                            {"label": i, "value": i} for i in ["All"] + product_types
+                        ],
+                        value="All",
+                    ),  ## selected state
+                    dcc.Graph(id="graph-4"),  # Reviews evolution
+                ],
+                style=graph_style,
+            ),
+            # This graph does not have a dropdown or a callback, it does not update
+            html.Div(
+                dcc.Graph(
+                    figure=px.histogram(
+                        x=n_reviews,
+                        y=users,
+                        title="Reviews per user",
+                        nbins=len(users),
+                    ),
+                    id="graph-5",  # Reviews per user
                 ),
-                id="graph-5",  # Reviews per user
+                style=graph_style,
             ),
-            style=graph_style,
-        ),
-        html.Div(
-            [
-                dcc.Dropdown(
-                    id="dropdown-6",  ## dropdown menu
-                    options=[{"label": i, "value": i} for i in product_types],
-                    value=product_types[0],
-                ),  ## selected state
-                dcc.Graph(id="graph-6"),  # Wordcloud
-            ],
-            style=graph_style,
-        ),  ## selected state
-        html.Div(
-            [
-                dcc.Dropdown(
-                    id="dropdown-7",  ## dropdown menu
-                    options=[{"label": i, "value": i} for i in ["All"] + product_types],
-                    value="All",
-                ),  ## selected state
-                dcc.Graph(id="graph-7"),  # Average evolution
-            ],
-            style=graph_style,
-        ),  ## selected state
-    ]
-)
+            html.Div(
+                [
+                    dcc.Dropdown(
+                        id="dropdown-6",  ## dropdown menu
+                        options=[{"label": i, "value": i} for i in product_types],
+                        value=product_types[0] if product_types else None,
+                    ),  ## selected state
+                    dcc.Graph(id="graph-6"),  # Wordcloud
+                ],
+                style=graph_style,
+            ),  ## selected state
+            html.Div(
+                [
+                    dcc.Dropdown(
+                        id="dropdown-7",  ## dropdown menu
+                        options=[
+                            {"label": i, "value": i} for i in ["All"] + product_types
+                        ],
+                        value="All",
+                    ),  ## selected state
+                    dcc.Graph(id="graph-7"),  # Average evolution
+                ],
+                style=graph_style,
+            ),  ## selected state
+        ]
+    )
 
 
 # Step 3. Set the callback functions
@@ -263,7 +351,7 @@ the dashboard is launched
 
 # In these decorators, the input and output of
 # each callback function are specified
-@app.callback(
+@callback(
     Output(component_id="graph-1", component_property="figure"),
     Input(component_id="dropdown-1", component_property="value"),
 )
@@ -272,14 +360,15 @@ def update_graph(selected_category):
     Updates graph 1 based on the selected category
     """
     if selected_category == "All":
-        selected_category = product_types
+        selected_category = dashboard_stats()["product_types"]
     else:
         selected_category = [selected_category]
 
-    sql = """SELECT year(reviewTime), COUNT(*)
-                FROM review
+    # The summary tables are used instead of review (see aggregates.py)
+    sql = """SELECT NULLIF(year, 0), CAST(SUM(reviews) AS SIGNED)
+                FROM agg_type_year
                 WHERE type in %s
-                GROUP BY year(reviewTime);
+                GROUP BY year;
         """
     x, y = sql_queries(sql, [selected_category])
     bar_fig = px.bar(
@@ -290,7 +379,7 @@ def update_graph(selected_category):
     return bar_fig
 
 
-@app.callback(
+@callback(
     Output(component_id="graph-2", component_property="figure"),
     Input(component_id="dropdown-2", component_property="value"),
 )
@@ -299,15 +388,15 @@ def update_graph(selected_category):
     Updates graph 2 based on the selected category
     """
     if selected_category == "All":
-        selected_category = product_types
+        selected_category = dashboard_stats()["product_types"]
     else:
         selected_category = [selected_category]
 
-    sql = """SELECT asin, COUNT(*)
-                FROM review
+    sql = """SELECT NULLIF(asin, ''), CAST(SUM(reviews) AS SIGNED) AS n_reviews
+                FROM agg_rating
                 WHERE type in %s
                 GROUP BY asin
-                ORDER BY COUNT(*) DESC;
+                ORDER BY n_reviews DESC;
         """
 
     x, y = sql_queries(sql, [selected_category])
@@ -320,7 +409,7 @@ def update_graph(selected_category):
     return line_fig
 
 
-@app.callback(
+@callback(
     Output(component_id="graph-3", component_property="figure"),
     Input(component_id="dropdown-3", component_property="value"),
 )
@@ -329,13 +418,13 @@ def update_graph(selected_category):
     Updates graph 3 based on the selected category
     """
     if selected_category == "All":
-        selected_category = product_types
+        selected_category = dashboard_stats()["product_types"]
     else:
         selected_category = [selected_category]
 
     # Since we don't know if what we receive is an asin or a category, we try to search for both
-    sql = """SELECT overall, COUNT(*)
-                FROM review
+    sql = """SELECT NULLIF(overall, 0), CAST(SUM(reviews) AS SIGNED)
+                FROM agg_rating
                 WHERE type in %s OR asin in %s
                 GROUP BY overall
                 ORDER BY overall;
@@ -350,7 +439,34 @@ def update_graph(selected_category):
     return bar_fig
 
 
-@app.callback(
+@callback(
+    Output(component_id="dropdown-3", component_property="options"),
+    Input(component_id="dropdown-3", component_property="search_value"),
+    State(component_id="dropdown-3", component_property="value"),
+)
+def update_asin_options(search_value, selected_value):
+    """
+    Updates the options of dropdown 3 with the first SUGERENCIAS_ASIN asins that start
+    with the typed text, keeping the selected one
+    """
+    options = ["All"] + dashboard_stats()["product_types"]
+    if search_value:
+        # The primary key of product is sorted by asin, so the prefix is an index range
+        prefix = re.sub(r"([\\%_])", r"\\\1", search_value)
+        sql = """SELECT DISTINCT asin
+                    FROM product
+                    WHERE asin LIKE %s
+                    ORDER BY asin
+                    LIMIT %s;
+            """
+        asins = sql_queries(sql, [f"{prefix}%", c.SUGERENCIAS_ASIN])
+        options += list(asins[0]) if asins else []
+    if selected_value and selected_value not in options:
+        options.append(selected_value)
+    return [{"label": i, "value": i} for i in options]
+
+
+@callback(
     Output(component_id="graph-4", component_property="figure"),
     Input(component_id="dropdown-4", component_property="value"),
 )
@@ -359,19 +475,28 @@ def update_graph(selected_category):
     Updates graph 4 based on the selected category
     """
     if selected_category == "All":
-        selected_category = product_types
+        selected_category = dashboard_stats()["product_types"]
     else:
         selected_category = [selected_category]
 
-    sql = """SELECT unixReviewTime
-                FROM review
-                WHERE type in %s 
-                ORDER BY unixReviewTime;
+    # The reviews are counted in PUNTOS_GRAFICA_EVOLUCION buckets of time by the server,
+    # so only one row per bucket is transferred. The last time of each bucket with the
+    # reviews up to it is a point of the curve
+    sql = """SELECT MAX(r.unixReviewTime), COUNT(*)
+                FROM review r,
+                    (SELECT MIN(unixReviewTime) AS first_time,
+                            (MAX(unixReviewTime) - MIN(unixReviewTime)) / %s + 1 AS width
+                        FROM review
+                        WHERE type in %s) AS b
+                WHERE r.type in %s AND r.unixReviewTime IS NOT NULL
+                GROUP BY FLOOR((r.unixReviewTime - b.first_time) / b.width)
+                ORDER BY 1;
         """
-    d = sql_queries(sql, [selected_category])
-    y, x = list(zip(*enumerate(d[0])))
-    y = y[::100]
-    x = x[::100]
+    x, counts = sql_queries(
+        sql, [c.PUNTOS_GRAFICA_EVOLUCION, selected_category, selected_category]
+    )
+    # Position of the last review of each bucket, as the index of the original curve
+    y = [n - 1 for n in accumulate(counts)]
     line_fig = px.line(
         x=x,
         y=y,
@@ -380,7 +505,7 @@ def update_graph(selected_category):
     return line_fig
 
 
-@app.callback(
+@callback(
     Output(component_id="graph-6", component_property="figure"),
     Input(component_id="dropdown-6", component_property="value"),
 )
@@ -389,17 +514,25 @@ def update_graph(selected_category):
     Updates graph 6 based on the selected category
     """
 
-    sql = """SELECT id
-                FROM review
-                WHERE type in %s 
+    # The rendered cloud of each category is kept, it only changes when more data is loaded
+    key = ("graph-6", selected_category)
+    cached_figure = figure_cache.get(key)
+    METRICS.cache_lookup("figure", cached_figure is not None)
+    if cached_figure is not None:
+        return cached_figure
+
+    # The frequencies of the words are counted during the load (see aggregates.py)
+    sql = """SELECT term, frequency
+                FROM agg_term
+                WHERE type = %s
+                ORDER BY frequency DESC
+                LIMIT %s;
         """
-    d = sql_queries(sql, [[selected_category]])
-    x = [int(i) for i in d[0]]
-    data = collection.find({"id": {"$in": x}}, {"summary": 1, "_id": 0})
-    wordcloud_text = " ".join(
-        [" ".join([i for i in j["summary"].split() if len(i) > 2]) for j in data]
-    )
-    word_cloud = WordCloud(background_color="white").generate(wordcloud_text)
+    terms = sql_queries(sql, [selected_category, c.PALABRAS_NUBE])
+    frequencies = dict(zip(*terms))
+    word_cloud = WordCloud(
+        background_color="white", max_words=c.PALABRAS_NUBE
+    ).generate_from_frequencies(frequencies)
 
     # To display it in plotly, it is necessary to convert the wordcloud to an image and export it this way
     word_cloud = px.imshow(word_cloud.to_array())
@@ -411,10 +544,11 @@ def update_graph(selected_category):
         paper_bgcolor="#F9F9FA",
         plot_bgcolor="#F9F9FA",
     )
+    figure_cache.put(key, word_cloud)
     return word_cloud
 
 
-@app.callback(
+@callback(
     Output(component_id="graph-7", component_property="figure"),
     Input(component_id="dropdown-7", component_property="value"),
 )
@@ -423,19 +557,19 @@ def update_graph(selected_category):
     Updates graph 7 based on the selected category
     """
     if selected_category == "All":
-        selected_category = product_types
+        selected_category = dashboard_stats()["product_types"]
     else:
         selected_category = [selected_category]
 
-    sql = """SELECT type, YEAR(reviewTime), AVG(overall)
-                FROM review
-                WHERE type in %s 
-                GROUP BY type, YEAR(reviewTime)
-                ORDER BY YEAR(reviewTime);
+    sql = """SELECT type, NULLIF(year, 0), overall_sum / NULLIF(rated, 0)
+                FROM agg_type_year
+                WHERE type in %s;
         """
     types, year, overall = sql_queries(sql, [selected_category])
     df = pd.DataFrame([types, year, overall]).transpose()
     df.columns = ["type", "year", "average_overall"]
+    # Sorted here, since with several types the rows come from several ranges of the key
+    df = df.sort_values("year")
     selected_df = df[df["type"].isin(selected_category)]
 
     line_fig = px.line(
@@ -448,7 +582,29 @@ def update_graph(selected_category):
     return line_fig
 
 
-# Step 4. run the app in the external mode
+def create_app() -> Dash:
+    """
+    Creates the Dash app. Nothing is queried until the first page is loaded, so it is
+    created in milliseconds and without the databases
+
+    Returns:
+        Dash: the app, with the callbacks of this module
+    """
+    # Step 1. Create the app
+    app = Dash(__name__)
+
+    # Step 2. Set the title
+    app.title = "Amazon Reviews Visualization Menu"
+
+    # Step 3. Set the layout, which is built on each page load
+    app.layout = serve_layout
+
+    # Step 4. Record the time of the callbacks and queries, shown in /metrics
+    install_metrics(app)
+    return app
+
+
+# Step 5. run the app in the external mode
 
 if __name__ == "__main__":
-    app.run_server()
+    create_app().run_server()
@@ -0,0 +1,87 @@
+"""
+================
+data_version.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the version of the data stored in SQL. load_data.py and insert_dataset.py
+increase it in each commit, so dashboard.py can tell if the data changed since it computed
+its statistics without computing them again. The version starts at 0 each time the database
+is created again, so a random stamp written with the table tells two databases apart.
+"""
+
+import pymysql
+from pymysql.constants import ER
+from uuid import uuid4
+
+SQL_DATA_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INT NOT NULL,
+        version BIGINT NOT NULL,
+        stamp CHAR(36),
+        PRIMARY KEY (id)
+    );"""
+
+
+def create_data_version_table(cursor) -> None:
+    """
+    Creates the table with the version of the data and its stamp if it does not exist
+
+    Args:
+        cursor: cursor of the SQL connection
+    """
+    cursor.execute(SQL_DATA_VERSION_TABLE)
+    # The tables created before the stamp existed receive it now
+    cursor.execute(
+        """SELECT COUNT(*)
+            FROM information_schema.columns
+            WHERE table_schema = DATABASE()
+                AND table_name = 'data_version'
+                AND column_name = 'stamp';"""
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute("ALTER TABLE data_version ADD COLUMN stamp CHAR(36);")
+    stamp = str(uuid4())
+    cursor.execute(
+        "INSERT IGNORE INTO data_version (id, version, stamp) VALUES (1, 0, %s);", stamp
+    )
+    cursor.execute("UPDATE data_version SET stamp = %s WHERE stamp IS NULL;", stamp)
+    cursor.connection.commit()
+
+
+def bump_data_version(cursor) -> None:
+    """
+    Increases the version of the data. It is passed to the commit of the writer as a hook,
+    so the version changes in the same transaction as the data
+
+    Args:
+        cursor: cursor of the SQL connection
+    """
+    cursor.execute("UPDATE data_version SET version = version + 1 WHERE id = 1;")
+
+
+def get_data_version(cursor) -> list:
+    """
+    Returns the stamp of the database and the version of its data
+
+    Args:
+        cursor: cursor of the SQL connection
+
+    Returns:
+        list: the stamp and the version, None and 0 if the database was loaded before they
+              existed
+    """
+    try:
+        cursor.execute("SELECT stamp, version FROM data_version WHERE id = 1;")
+    except pymysql.err.ProgrammingError:
+        return [None, 0]
+    except pymysql.err.OperationalError as e:
+        # Table created before the stamp existed and not loaded since
+        if e.args[0] != ER.BAD_FIELD_ERROR:
+            raise
+        cursor.execute("SELECT version FROM data_version WHERE id = 1;")
+        row = cursor.fetchone()
+        return [None, row[0] if row else 0]
+    row = cursor.fetchone()
+    return list(row) if row else [None, 0]
@@ -0,0 +1,271 @@
+"""
+================
+dedup_index.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the index of the reviewers and products already stored in the databases.
+It is saved to disk after each load, so load_data.py and insert_dataset.py can check if a
+row has to be inserted without querying SQL. Only one process at a time owns the saved
+index, the one that holds the lock of its file. A load that runs while another one owns
+it builds a private index from SQL and does not save it; the rows it inserts that the
+saved index misses are skipped by SQL (INSERT IGNORE) in the next load.
+
+Regarding the configuration parameters, the file is set with FICHERO_INDICE_DEDUP. With
+INDICE_EN_DISCO the reviewers are kept in an SQLite file (FICHERO_INDICE_REVIEWERS) with
+only the most recent TAMANO_CACHE_REVIEWERS in memory, so the memory used does not grow
+with the number of reviewers.
+"""
+
+import config as c
+import os
+import pickle
+import sqlite3
+import tempfile
+from collections import OrderedDict
+from pymysql.cursors import SSCursor
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+def lock_file(file) -> bool:
+    """
+    Takes the exclusive lock of an open file without waiting. The lock is released when
+    the file is closed, also if the process ends
+
+    Args:
+        file: the open file
+
+    Returns:
+        bool: True if the lock was taken, False if another process holds it
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+class ReviewerStore:
+    """
+    Map of reviewerID -> first reviewerName seen, stored in SQLite with an LRU cache in
+    front. It supports the dictionary operations used by the loaders (in, [] and update)
+
+    Args:
+        path (str, optional): SQLite file. Defaults to FICHERO_INDICE_REVIEWERS.
+        cache_size (int, optional): reviewers kept in memory. Defaults to TAMANO_CACHE_REVIEWERS.
+    """
+
+    # New reviewers are written to SQLite in groups of this size
+    WRITE_SIZE = 10000
+
+    def __init__(self, path=None, cache_size=None):
+        self.path = path or c.FICHERO_INDICE_REVIEWERS
+        self.cache_size = cache_size or c.TAMANO_CACHE_REVIEWERS
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS reviewer (
+                reviewerID TEXT PRIMARY KEY,
+                reviewerName TEXT
+            ) WITHOUT ROWID;"""
+        )
+        self.cache = OrderedDict()
+        self.pending = {}
+
+    def remember(self, reviewer_id, reviewer_name):
+        """Puts a reviewer in the cache, evicting the least recently used one if it is full."""
+        self.cache[reviewer_id] = reviewer_name
+        self.cache.move_to_end(reviewer_id)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def __contains__(self, reviewer_id):
+        if reviewer_id in self.cache:
+            self.cache.move_to_end(reviewer_id)
+            return True
+        if reviewer_id in self.pending:
+            return True
+        row = self.connection.execute(
+            "SELECT reviewerName FROM reviewer WHERE reviewerID = ?;", (reviewer_id,)
+        ).fetchone()
+        if row is None:
+            return False
+        self.remember(reviewer_id, row[0])
+        return True
+
+    def __getitem__(self, reviewer_id):
+        if reviewer_id not in self:
+            raise KeyError(reviewer_id)
+        if reviewer_id in self.pending:
+            return self.pending[reviewer_id]
+        return self.cache[reviewer_id]
+
+    def __setitem__(self, reviewer_id, reviewer_name):
+        self.pending[reviewer_id] = reviewer_name
+        self.remember(reviewer_id, reviewer_name)
+        if len(self.pending) >= self.WRITE_SIZE:
+            self.write()
+
+    def update(self, reviewers):
+        """
+        Adds several reviewers
+
+        Args:
+            reviewers (iterable): (reviewerID, reviewerName) pairs
+        """
+        for reviewer_id, reviewer_name in reviewers:
+            self[reviewer_id] = reviewer_name
+
+    def write(self):
+        """Writes the new reviewers to SQLite, without committing them."""
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO reviewer (reviewerID, reviewerName) VALUES (?, ?);",
+            self.pending.items(),
+        )
+        self.pending = {}
+
+    def commit(self):
+        """Writes the new reviewers and commits them."""
+        self.write()
+        self.connection.commit()
+
+    def clear(self):
+        """Deletes every reviewer."""
+        self.connection.execute("DELETE FROM reviewer;")
+        self.connection.commit()
+        self.cache.clear()
+        self.pending = {}
+
+    def close(self):
+        """Closes the SQLite file."""
+        self.connection.close()
+
+
+class DedupIndex:
+    """
+    Index of the reviewers (reviewerID -> first reviewerName seen) and products
+    ((asin, type) pairs) stored in SQL, together with the last review id it covers
+
+    Args:
+        path (str, optional): file where the index is saved. Defaults to FICHERO_INDICE_DEDUP.
+        empty (bool, optional): start with no reviewers even if they are stored on disk.
+                                Defaults to True.
+    """
+
+    def __init__(self, path=None, empty=True):
+        self.path = path or c.FICHERO_INDICE_DEDUP
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = open(f"{self.path}.lock", "a")
+        self.owner = lock_file(self.lock)
+        self.private_path = None
+        if c.INDICE_EN_DISCO and not self.owner:
+            # The SQLite file of the owner is not touched, the reviewers go to a new one
+            handle, self.private_path = tempfile.mkstemp(
+                suffix=".sqlite",
+                dir=os.path.dirname(c.FICHERO_INDICE_REVIEWERS) or None,
+            )
+            os.close(handle)
+            self.reviewers = ReviewerStore(self.private_path)
+        else:
+            self.reviewers = ReviewerStore() if c.INDICE_EN_DISCO else {}
+            if empty and c.INDICE_EN_DISCO:
+                self.reviewers.clear()
+        self.products = set()
+        self.last_id = 0
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        Loads the index saved on disk, or returns an empty one if there is none
+
+        Args:
+            path (str, optional): file where the index is saved. Defaults to FICHERO_INDICE_DEDUP.
+
+        Returns:
+            DedupIndex: the loaded index, or an empty one with last_id -1 if another
+                        process owns it
+        """
+        index = cls(path, empty=False)
+        if not index.owner:
+            # Another process owns the saved index, so this one is built from SQL
+            index.last_id = -1
+        elif os.path.exists(index.path):
+            with open(index.path, "rb") as f:
+                reviewers, index.products, index.last_id = pickle.load(f)
+            if (reviewers is None) != c.INDICE_EN_DISCO:
+                # It was saved with the other INDICE_EN_DISCO value, so it must be rebuilt
+                index.last_id = -1
+            elif reviewers is not None:
+                index.reviewers = reviewers
+        return index
+
+    def rebuild(self, cursor) -> None:
+        """
+        Fills the index from the SQL tables. It is only needed when the saved index
+        is missing or does not match the database
+
+        Args:
+            cursor: cursor of the SQL connection
+        """
+        if c.INDICE_EN_DISCO:
+            self.reviewers.clear()
+        else:
+            self.reviewers = {}
+        # The reviewers are streamed from the server instead of fetched all at once
+        with cursor.connection.cursor(SSCursor) as reviewer_cursor:
+            reviewer_cursor.execute("SELECT reviewerID, reviewerName FROM reviewer;")
+            while rows := reviewer_cursor.fetchmany(ReviewerStore.WRITE_SIZE):
+                self.reviewers.update(rows)
+        cursor.execute("SELECT asin, type FROM product;")
+        self.products = set(cursor.fetchall())
+        cursor.execute("SELECT MAX(id) FROM review;")
+        self.last_id = cursor.fetchone()[0] or 0
+
+    def save(self, last_id: int) -> None:
+        """
+        Saves the index to disk if this process owns it. It must be called after the commit
+        of the rows it contains
+
+        Args:
+            last_id (int): id of the last review committed
+        """
+        self.last_id = last_id
+        if not self.owner:
+            return
+        if c.INDICE_EN_DISCO:
+            self.reviewers.commit()
+        # The file is replaced at once so an interrupted save does not corrupt it
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or None)
+        with os.fdopen(handle, "wb") as f:
+            pickle.dump(
+                (
+                    None if c.INDICE_EN_DISCO else self.reviewers,
+                    self.products,
+                    self.last_id,
+                ),
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, self.path)
+
+    def close(self) -> None:
+        """Releases the lock of the saved index and deletes the private SQLite file."""
+        if self.private_path is not None:
+            self.reviewers.close()
+            os.remove(self.private_path)
+            self.private_path = None
+        self.lock.close()
@@ -0,0 +1,129 @@
+"""
+================
+file_reader.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file reads the data files in chunks of lines and parses and cleans them, either in
+the main process or in a pool of worker processes. It is used by load_data.py and
+insert_dataset.py, which assign the ids and write the records in the order they are returned.
+
+Regarding the configuration parameters, PROCESOS_INGESTA and TAMANO_TROZO should be checked.
+"""
+
+import config as c
+import json
+import os
+from collections import deque
+from multiprocessing import Pool
+from time import perf_counter
+from normalization import normalize_block
+from profiler import PROFILER
+
+
+def parse_chunk(chunk: tuple) -> tuple:
+    """
+    Parses and cleans a chunk of lines. It is the task executed by the worker processes,
+    so it only receives and returns picklable data
+
+    Args:
+        chunk (tuple): the list of raw lines and the product type
+
+    Returns:
+        list, dict: the cleaned reviews, in the same order as the lines, and the seconds
+                    spent in the json_decode and normalization stages
+    """
+    lines, file_type = chunk
+    t = perf_counter()
+    records = [json.loads(line) for line in lines]
+    t_decode = perf_counter()
+    records = normalize_block(records, file_type)
+    t_normalize = perf_counter()
+    return records, {
+        "json_decode": t_decode - t,
+        "normalization": t_normalize - t_decode,
+    }
+
+
+def collect(result: tuple) -> list:
+    """
+    Records the stage times of a parsed chunk in the profiler
+
+    Args:
+        result (tuple): the value returned by parse_chunk
+
+    Returns:
+        list: the cleaned reviews
+    """
+    records, timings = result
+    for stage, seconds in timings.items():
+        PROFILER.record(stage, seconds)
+    return records
+
+
+def split_lines(f, chunk_size: int):
+    """
+    Groups the lines of an open file in lists of chunk_size lines
+
+    Args:
+        f (file): the data file, opened in binary mode
+        chunk_size (int): number of lines per chunk
+
+    Yields:
+        list, int: the lines of each chunk and the byte offset where the chunk ends
+    """
+    offset = f.tell()
+    lines = []
+    for line in f:
+        lines.append(line)
+        offset += len(line)
+        if len(lines) == chunk_size:
+            yield lines, offset
+            lines = []
+    if lines:
+        yield lines, offset
+
+
+def read_chunks(path: str, file_type: str, offset=0, processes=None, chunk_size=None):
+    """
+    Reads a data file and yields its reviews already cleaned, chunk by chunk and in file
+    order, so whoever assigns the ids gets the same ones in every run
+
+    Args:
+        path (str): path of the data file
+        file_type (str): the product type, taken from the file name
+        offset (int, optional): byte offset where the reading starts. Defaults to 0.
+        processes (int, optional): worker processes, 1 parses in this process.
+                                   Defaults to PROCESOS_INGESTA (None there uses every core).
+        chunk_size (int, optional): lines per chunk. Defaults to TAMANO_TROZO.
+
+    Yields:
+        list, int: the cleaned reviews of each chunk and the byte offset where it ends
+    """
+    processes = c.PROCESOS_INGESTA if processes is None else processes
+    chunk_size = chunk_size or c.TAMANO_TROZO
+
+    # Binary mode keeps the offsets exact so that a load can be resumed from them
+    with open(path, "rb") as f:
+        f.seek(offset)
+        if processes == 1:
+            for lines, end in split_lines(f, chunk_size):
+                yield collect(parse_chunk((lines, file_type))), end
+            return
+
+        with Pool(processes) as pool:
+            # Pool.imap would read the whole file ahead of the workers, so the chunks in
+            # flight are bounded by hand. Results are collected in submission order.
+            max_pending = 2 * (processes or os.cpu_count())
+            pending = deque()
+            for lines, end in split_lines(f, chunk_size):
+                pending.append(
+                    (pool.apply_async(parse_chunk, ((lines, file_type),)), end)
+                )
+                if len(pending) >= max_pending:
+                    result, end = pending.popleft()
+                    yield collect(result.get()), end
+            while pending:
+                result, end = pending.popleft()
+                yield collect(result.get()), end
@@ -0,0 +1,154 @@
+"""
+================
+generate_data.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file generates synthetic review files with the same schema as the Amazon *_5.json
+files, to measure the loaders with benchmark.py without the real dataset.
+
+Regarding the configuration parameters, the size and skew of the data are set with the
+command line arguments, whose defaults are in the benchmark section of config.py.
+"""
+
+import config as c
+import argparse
+import json
+import os
+import random
+import string
+from datetime import datetime, timezone
+from itertools import accumulate
+
+WORDS = (
+    "great good bad love fun game sound quality price works easy product music album "
+    "songs play guitar toy kids gift perfect nice recommend better worth best money "
+    "cheap broken amazing favorite classic strings controller graphics story time"
+).split()
+
+# Reviews between 1999 and 2014, like the real dataset
+FIRST_TIME = 915148800
+LAST_TIME = 1406073600
+
+
+def random_id(prefix: str, length: int, rng: random.Random) -> str:
+    """
+    Creates an identifier similar to the Amazon ones
+
+    Args:
+        prefix (str): first characters of the id
+        length (int): total length of the id
+        rng (random.Random): the random generator
+
+    Returns:
+        str: the identifier
+    """
+    alphabet = string.ascii_uppercase + string.digits
+    return prefix + "".join(rng.choices(alphabet, k=length - len(prefix)))
+
+
+def zipf_weights(n: int, skew: float) -> list:
+    """
+    Cumulative weights so that the element of rank k is chosen with probability
+    proportional to 1 / k^skew. A skew of 0 gives a uniform distribution
+
+    Args:
+        n (int): number of elements
+        skew (float): exponent of the distribution
+
+    Returns:
+        list: the cumulative weights
+    """
+    return list(accumulate(1 / (rank**skew) for rank in range(1, n + 1)))
+
+
+def generate_review(reviewer: tuple, asin: str, rng: random.Random) -> dict:
+    """
+    Creates a review in the schema of the dataset
+
+    Args:
+        reviewer (tuple): reviewerID and reviewerName
+        asin (str): the reviewed product
+        rng (random.Random): the random generator
+
+    Returns:
+        dict: the review
+    """
+    unix_time = rng.randint(FIRST_TIME, LAST_TIME)
+    date = datetime.fromtimestamp(unix_time, timezone.utc)
+    helpful_total = rng.randint(0, 10)
+    return {
+        "reviewerID": reviewer[0],
+        "asin": asin,
+        "reviewerName": reviewer[1],
+        "helpful": [rng.randint(0, helpful_total), helpful_total],
+        "reviewText": " ".join(rng.choices(WORDS, k=rng.randint(10, 120))),
+        "overall": float(rng.choices([1, 2, 3, 4, 5], [5, 5, 10, 25, 55])[0]),
+        "summary": " ".join(rng.choices(WORDS, k=rng.randint(1, 6))).capitalize(),
+        "unixReviewTime": unix_time,
+        "reviewTime": date.strftime("%m %d, %Y"),
+    }
+
+
+def generate_files(
+    directory: str,
+    n_files: int,
+    scale: float,
+    skew: float,
+    seed: int = 0,
+    prefix: str = "Synthetic",
+) -> list:
+    """
+    Writes n_files synthetic files of BASE_RESENAS_BENCHMARK * scale reviews each. The
+    reviewers are shared between files and both reviewers and products follow a Zipf
+    distribution with the given skew
+
+    Args:
+        directory (str): directory where the files are written
+        n_files (int): number of files (categories)
+        scale (float): scale factor of the number of reviews
+        skew (float): exponent of the Zipf distribution of reviewers and products
+        seed (int, optional): seed of the random generator. Defaults to 0.
+        prefix (str, optional): first part of the file names. Defaults to "Synthetic".
+
+    Returns:
+        list: the names of the files
+    """
+    rng = random.Random(seed)
+    n_reviews = int(c.BASE_RESENAS_BENCHMARK * scale)
+    # Proportions similar to the real 5-core files
+    reviewers = [
+        (random_id("A", 14, rng), " ".join(rng.choices(WORDS, k=2)).title())
+        for _ in range(max(1, n_reviews // 8))
+    ]
+    reviewer_weights = zipf_weights(len(reviewers), skew)
+
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for n_file in range(n_files):
+        asins = [random_id("B00", 10, rng) for _ in range(max(1, n_reviews // 20))]
+        asin_weights = zipf_weights(len(asins), skew)
+        name = f"{prefix}_{n_file + 1}_5.json"
+        with open(os.path.join(directory, name), "w") as f:
+            for _ in range(n_reviews):
+                reviewer = rng.choices(reviewers, cum_weights=reviewer_weights)[0]
+                asin = rng.choices(asins, cum_weights=asin_weights)[0]
+                f.write(json.dumps(generate_review(reviewer, asin, rng)) + "\n")
+        names.append(name)
+    return names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates synthetic review files")
+    parser.add_argument("--directory", default=c.DIRECTORIO_BENCHMARK)
+    parser.add_argument("--files", type=int, default=c.FICHEROS_BENCHMARK)
+    parser.add_argument("--scale", type=float, default=c.ESCALA_BENCHMARK)
+    parser.add_argument("--skew", type=float, default=c.SESGO_BENCHMARK)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for name in generate_files(
+        args.directory, args.files, args.scale, args.skew, args.seed
+    ):
+        print(name)
@@ -0,0 +1,76 @@
+"""
+================
+id_allocator.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file hands out blocks of review ids from a sequence table in SQL, so that several
+insert_dataset.py processes can append files at the same time without repeating ids.
+The same ids are used in SQL and MongoDB.
+"""
+
+import config as c
+import pymysql
+
+
+SQL_SEQUENCE_TABLE = """
+    CREATE TABLE IF NOT EXISTS id_sequence (
+        name VARCHAR(40) NOT NULL,
+        next_id INT NOT NULL,
+        PRIMARY KEY (name)
+    );"""
+
+# If the sequence does not exist yet it starts after the last review loaded
+SQL_SEQUENCE_START = """INSERT IGNORE INTO id_sequence (name, next_id)
+                        SELECT %s, COALESCE(MAX(id), 0) + 1
+                        FROM review;"""
+
+# LAST_INSERT_ID(expr) keeps the new value for this connection, so the block is
+# reserved with a single atomic statement
+SQL_RESERVE = """UPDATE id_sequence
+                    SET next_id = LAST_INSERT_ID(next_id + %s)
+                    WHERE name = %s;"""
+
+
+class IdAllocator:
+    """
+    Reserves blocks of consecutive ids. It uses its own connection in autocommit mode,
+    so a reservation is never undone and does not wait for the load transaction
+
+    Args:
+        name (str, optional): name of the sequence. Defaults to "review".
+    """
+
+    def __init__(self, name="review"):
+        self.name = name
+        self.connection = pymysql.connect(
+            host="localhost",
+            user=c.USUARIO_SQL,
+            password=c.PASSWORD_SQL,
+            database=c.NOMBRE_BASE_SQL,
+            autocommit=True,
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(SQL_SEQUENCE_TABLE)
+            cursor.execute(SQL_SEQUENCE_START, self.name)
+
+    def reserve(self, size: int):
+        """
+        Reserves a block of ids that no other process will receive
+
+        Args:
+            size (int): number of ids of the block
+
+        Returns:
+            int, int: the first id of the block and the first id after it
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute(SQL_RESERVE, [size, self.name])
+            cursor.execute("SELECT LAST_INSERT_ID();")
+            end = cursor.fetchone()[0]
+        return end - size, end
+
+    def close(self):
+        """Closes the connection of the allocator."""
+        self.connection.close()
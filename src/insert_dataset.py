@@ -11,20 +11,38 @@ Regarding the configuration parameters, SQL credentials and data paths should be
 """
 
 import config as c
+import argparse
 import os
-import json
 from pymongo import MongoClient
 import pymysql
 from time import perf_counter
+from batch_writer import BatchWriter, UpsertWriter
+from pipeline import PipelinedWriter, prefetch
+from file_reader import read_chunks
+from dedup_index import DedupIndex
+from profiler import PROFILER
+from aggregates import Aggregates, ensure_aggregate_tables
+from data_version import create_data_version_table, bump_data_version
+from mongodb_fields import mongodb_fields, create_mongodb_indexes
+from id_allocator import IdAllocator
+from partitions import add_type_partition
+from checkpoint import (
+    create_checkpoint_table,
+    get_checkpoint,
+    is_finished,
+    save_checkpoint,
+    discard_uncommitted,
+)
 
 
-def create_sql_insertion(table_name, guide) -> str:
+def create_sql_insertion(table_name, guide, ignore=False) -> str:
     """Returns an SQL query to insert data into the 'table_name' table,
     which follows the 'guide' structure.
 
     Args:
         table_name (str): name of the table to which the data is to be inserted.
         guide (list): names of the table fields
+        ignore (bool, optional): skip the rows whose key already exists. Defaults to False.
 
     Returns:
         str: parameterized SQL query to insert data
@@ -38,35 +56,56 @@ def create_sql_insertion(table_name, guide) -> str:
     string_param = string_param.rstrip(", ")
     string_guide = string_guide.rstrip(", ")
 
-    return f"""INSERT INTO {table_name} ({string_guide})
+    return f"""INSERT {"IGNORE " if ignore else ""}INTO {table_name} ({string_guide})
             VALUES ({string_param});
     """
 
 
 # *** General ***
-def insert_dataset(file_name):
-    """Cleans and inserts data into the already created databases."""
-    sql_insertions = [
-        create_sql_insertion(table_name, table_guide)
+def insert_dataset(file_name, resume=False, upsert=False):
+    """Cleans and inserts data into the already created databases.
+
+    Args:
+        file_name (str): name of the data file
+        resume (bool, optional): continue from the last checkpoint of the file. Defaults to False.
+        upsert (bool, optional): the file is a refreshed version of one already loaded, so its
+            reviews are matched with the stored ones and only the new or changed ones are
+            written. Defaults to False.
+
+    Returns:
+        dict: rows written and seconds spent by each sink
+
+    Raises:
+        Exception: if the file has an unfinished load and resume is not set
+    """
+    # Another load running at the same time may insert the same reviewers or products
+    sql_insertions = {
+        table_name: create_sql_insertion(
+            table_name, table_guide, ignore=table_name != "review"
+        )
         for table_name, table_guide in c.GUIAS_TABLAS_SQL.items()
-    ]
+    }
 
     sql_max_id = """SELECT id
                     FROM review
                     ORDER BY id DESC
                     LIMIT 1;"""
 
-    sql_reviewername = """SELECT reviewerName
-                        FROM reviewer
-                        WHERE reviewerID = %s
-                        LIMIT 1;"""
-
     mysql_connection = pymysql.connect(
         host="localhost",
         user=c.USUARIO_SQL,
         password=c.PASSWORD_SQL,
         database=c.NOMBRE_BASE_SQL,
     )
+    # Other loads may insert the same reviewers and products, so they are committed apart
+    # from the reviews, as soon as they are written, and the loads never wait for each other
+    shared_connection = pymysql.connect(
+        host="localhost",
+        user=c.USUARIO_SQL,
+        password=c.PASSWORD_SQL,
+        database=c.NOMBRE_BASE_SQL,
+        autocommit=True,
+    )
 
     # Create the database connection
     CONNECTION_STRING = "mongodb://localhost:27017"
@@ -75,100 +114,184 @@ def insert_dataset(file_name):
 
     # Access the collection
     collection = db[c.NOMBRE_TABLA_MONGODB]
+    create_mongodb_indexes(collection)
+    # Fields of the MongoDB documents, with the ones copied from SQL
+    document_fields = mongodb_fields()
 
+    PROFILER.reset()
     with mysql_connection:
         cursor = mysql_connection.cursor()
+        # A new type needs its partition before its reviews are inserted
+        add_type_partition(cursor, file_name[:-5])
+        # Summaries read by the dashboard, updated with each commit
+        ensure_aggregate_tables(cursor)
+        aggregates = Aggregates()
+        create_data_version_table(cursor)
+        shared_cursor = shared_connection.cursor()
+        if upsert:
+            writer = UpsertWriter(
+                cursor,
+                collection,
+                sql_insertions,
+                aggregates=aggregates,
+                shared_cursor=shared_cursor,
+            )
+        elif c.MODO_TUBERIA:
+            writer = PipelinedWriter(
+                cursor, collection, sql_insertions, shared_cursor=shared_cursor
+            )
+        else:
+            writer = BatchWriter(
+                cursor, collection, sql_insertions, shared_cursor=shared_cursor
+            )
+
+        try:
+            # Get the last id
+            cursor.execute(sql_max_id)
+            last_id = int(cursor.fetchone()[0])
+
+            # Index of the reviewers and products already in the database. If it is missing
+            # or it does not cover the last review, it is built again from SQL
+            index = DedupIndex.load()
+            if index.last_id != last_id:
+                index.rebuild(cursor)
 
-        # Get the next id
-        cursor.execute(sql_max_id)
-        id_review = int(cursor.fetchone()[0]) + 1
-
-        reviewers = (
-            {}
-        )  # must be a dictionary to save the reviewer's name to keep the first one that appears
-        asins = []
-        path = os.path.join(c.DIRECTORIO_DATOS, file_name)
-        print(file_name[:-5])
-        with open(path, "r") as f:
-            for line in f:
-                line = json.loads(line)
-
-                # *** Data processing ***
-                line["id"] = id_review
-                line["type"] = file_name[:-5]
-
-                # Set certain data to None
-                for guide_list in c.GUIAS_TABLAS_SQL.values():
-                    for guide_data in guide_list:
-                        if guide_data not in line:
-                            line[guide_data] = None
-                        elif line[guide_data] in ["", " "]:
-                            line[guide_data] = None
-
-                # Convert reviewTime to DATE format
-                if line["reviewTime"] is not None:
-                    # Example of reviewTime: 04 22, 2014
-                    # We can see that the three elements are separated by spaces
-                    reviewtime = line["reviewTime"].split(" ")
-                    if len(reviewtime) == 3:
-                        month, day, year = reviewtime
-                        day = day.strip(
-                            ","
-                        )  # day is the one that kept the comma from registered
-                        line["reviewTime"] = f"{year}-{month}-{day}"
-                    else:  # if it is not correct, we set it to NULL
-                        line["reviewTime"] = None
-
-                # Insert the reviewer if it has not already been created
-                if line["reviewerID"] is not None:
-                    if line["reviewerID"] not in reviewers:  # in the reviewers keys
-                        # We must ensure that it was not inserted before
-                        cursor.execute(sql_reviewername, line["reviewerID"])
-                        reviewername = cursor.fetchone()
-
-                        if reviewername is not None:
-                            reviewers[line["reviewerID"]] = line["reviewerName"]
+            # The ids are reserved in blocks that cover the reviews between two checkpoints,
+            # so other loads can run at the same time and a checkpoint knows its whole block
+            allocator = IdAllocator()
+            block_size = c.TAMANO_TROZO * c.TROZOS_POR_CHECKPOINT
+
+            path = os.path.join(c.DIRECTORIO_DATOS, file_name)
+            create_checkpoint_table(cursor)
+            offset = 0
+            checkpoint = get_checkpoint(cursor, file_name)
+            if resume and checkpoint is not None:
+                # Only what was committed with the checkpoint is kept, and its block is reused
+                offset, id_review, id_end = checkpoint
+                discard_uncommitted(collection, id_review, id_end)
+            # With --upsert a checkpoint is of the previous version of the file, whose size is
+            # different, or of an interrupted upsert, which can be repeated, so it is ignored
+            elif (
+                checkpoint is not None
+                and not upsert
+                and not is_finished(checkpoint, path)
+            ):
+                raise Exception(
+                    f"The load of {file_name} was interrupted, run it again with --resume"
+                )
+            else:
+                id_review, id_end = allocator.reserve(block_size)
+                # A checkpoint at the start of the file, so a crash before the first one
+                # can be resumed and the documents written before it are discarded
+                writer.commit(save_checkpoint(file_name, offset, id_review, id_end))
+
+            print(file_name[:-5])
+            PROFILER.start_file(file_name)
+            chunks = read_chunks(path, file_name[:-5], offset)
+            if c.MODO_TUBERIA:
+                chunks = prefetch(chunks)
+            for n_chunk, (records, offset) in enumerate(chunks, 1):
+                for line in records:
+                    # *** Data processing ***
+                    line["id"] = id_review
+
+                    # Insert the reviewer if it has not already been created
+                    t = perf_counter()
+                    new_reviewer = False
+                    if line["reviewerID"] is not None:
+                        if line["reviewerID"] not in index.reviewers:
+                            index.reviewers[line["reviewerID"]] = line["reviewerName"]
+                            new_reviewer = True
                         else:
-                            cursor.execute(
-                                sql_insertions[0],
-                                [
-                                    line[guide_data]
-                                    for guide_data in c.GUIAS_TABLAS_SQL["reviewer"]
-                                ],
-                            )
-                    else:
-                        line["reviewerName"] = reviewers[line["reviewerID"]]
-
-                # Insert the product if it has not already been done
-                if line["asin"] is not None and line["asin"] not in asins:
-                    asins.append(line["asin"])
-                    cursor.execute(
-                        sql_insertions[1],
-                        [
-                            line[guide_data]
-                            for guide_data in c.GUIAS_TABLAS_SQL["product"]
-                        ],
+                            line["reviewerName"] = index.reviewers[line["reviewerID"]]
+                    PROFILER.record("reviewer_dedup", perf_counter() - t)
+                    if new_reviewer:
+                        writer.add_row(
+                            "reviewer",
+                            [
+                                line[guide_data]
+                                for guide_data in c.GUIAS_TABLAS_SQL["reviewer"]
+                            ],
+                        )
+
+                    # Insert the product if it has not already been done
+                    t = perf_counter()
+                    product_key = (line["asin"], line["type"])
+                    new_product = (
+                        line["asin"] is not None and product_key not in index.products
                     )
+                    if new_product:
+                        index.products.add(product_key)
+                    PROFILER.record("product_dedup", perf_counter() - t)
+                    if new_product:
+                        writer.add_row(
+                            "product",
+                            [
+                                line[guide_data]
+                                for guide_data in c.GUIAS_TABLAS_SQL["product"]
+                            ],
+                        )
 
-                cursor.execute(
-                    sql_insertions[2],
-                    [line[guide_data] for guide_data in c.GUIAS_TABLAS_SQL["review"]],
-                )
+                    review_row = [
+                        line[guide_data] for guide_data in c.GUIAS_TABLAS_SQL["review"]
+                    ]
+                    writer.add_row("review", review_row)
+                    if not upsert:
+                        # The upsert writer counts only the reviews it inserts or updates
+                        aggregates.add(review_row)
+                        aggregates.add_terms(line["type"], line["summary"])
 
-                collection.insert_one(
-                    {
-                        guide_data: line[guide_data]
-                        for guide_data in c.GUIA_TABLA_MONGODB
-                    }
-                )
+                    writer.add_document(
+                        {guide_data: line[guide_data] for guide_data in document_fields}
+                    )
+
+                    last_id = id_review
+                    id_review += 1
 
-                id_review += 1
+                # Commit the progress every TROZOS_POR_CHECKPOINT chunks, with the block of
+                # ids of the next ones
+                if n_chunk % c.TROZOS_POR_CHECKPOINT == 0:
+                    id_review, id_end = allocator.reserve(block_size)
+                    writer.commit(
+                        save_checkpoint(file_name, offset, id_review, id_end),
+                        aggregates.apply,
+                        bump_data_version,
+                    )
+                    index.save(last_id)
 
-        mysql_connection.commit()
+            # The last checkpoint covers the whole file
+            writer.commit(
+                save_checkpoint(file_name, offset, id_review, id_end),
+                aggregates.apply,
+                bump_data_version,
+            )
+        finally:
+            # The threads of the pipelined writer are stopped also if the load fails
+            writer.close()
+            shared_connection.close()
         cursor.close()
+        allocator.close()
+        index.save(last_id)
+        index.close()
+        writer.report()
+        PROFILER.finish()
+    return writer.stats
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inserts a new file in the databases")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted load from its last checkpoint",
+    )
+    parser.add_argument(
+        "--upsert",
+        action="store_true",
+        help="load a refreshed version of a file, writing only new or changed reviews",
+    )
+    args = parser.parse_args()
+
     t = perf_counter()
-    insert_dataset(c.NOMBRE_FICHEROS_EXTRA)
+    insert_dataset(c.NOMBRE_FICHEROS_EXTRA, args.resume, args.upsert)
     print(f"Time to load data: {perf_counter() - t}")
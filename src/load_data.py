@@ -11,11 +11,29 @@ Regarding the configuration parameters, SQL credentials and data paths should be
 """
 
 import config as c
+import argparse
 import os
-import json
 from pymongo import MongoClient
 import pymysql
 from time import perf_counter
+from batch_writer import BatchWriter
+from bulk_load import InfileWriter
+from pipeline import PipelinedWriter, prefetch
+from file_reader import read_chunks
+from dedup_index import DedupIndex
+from profiler import PROFILER
+from aggregates import Aggregates, ensure_aggregate_tables
+from data_version import create_data_version_table, bump_data_version
+from mongodb_fields import mongodb_fields, create_mongodb_indexes
+from sql_indexes import create_sql_indexes
+from partitions import SQL_PARTITIONED_PRIMARY_KEY, sql_partition_review
+from checkpoint import (
+    create_checkpoint_table,
+    get_checkpoint,
+    get_next_id,
+    save_checkpoint,
+    discard_uncommitted,
+)
 
 
 # *** SQL ***
@@ -96,22 +114,37 @@ def create_mongodb_database() -> None:
     client.drop_database(c.NOMBRE_BASE_MONGODB)
 
     db = client[c.NOMBRE_BASE_MONGODB]
-    db.create_collection(c.NOMBRE_TABLA_MONGODB)
+    collection = db.create_collection(c.NOMBRE_TABLA_MONGODB)
+    if not c.CARGA_RAPIDA:
+        create_mongodb_indexes(collection)
 
 
 # *** General ***
-def clean_data() -> None:
-    """Cleans and inserts data into the empty databases."""
-    sql_insertions = [
-        create_sql_insertion(table_name, table_guide)
+# Writers that can be chosen with MODO_CARGA
+WRITERS = {"insert": BatchWriter, "infile": InfileWriter}
+
+
+def clean_data(resume: bool = False) -> dict:
+    """Cleans and inserts data into the empty databases.
+
+    Args:
+        resume (bool, optional): continue from the last checkpoints instead of starting
+            with empty databases. Defaults to False.
+
+    Returns:
+        dict: rows written and seconds spent by each sink
+    """
+    sql_insertions = {
+        table_name: create_sql_insertion(table_name, table_guide)
         for table_name, table_guide in c.GUIAS_TABLAS_SQL.items()
-    ]
+    }
 
     mysql_connection_table = pymysql.connect(
         host="localhost",
         user=c.USUARIO_SQL,
         password=c.PASSWORD_SQL,
         database=c.NOMBRE_BASE_SQL,
+        local_infile=c.MODO_CARGA == "infile",
     )
 
     # Create the connection to the new database
@@ -122,133 +155,279 @@ def clean_data() -> None:
     # Access the collection
     collection = db[c.NOMBRE_TABLA_MONGODB]
 
+    PROFILER.reset()
     with mysql_connection_table:
         cursor = mysql_connection_table.cursor()
+        if c.CARGA_RAPIDA:
+            # The tables still have no keys, so the checks are disabled for this session
+            cursor.execute("SET foreign_key_checks = 0;")
+            cursor.execute("SET unique_checks = 0;")
+        create_checkpoint_table(cursor)
+        # Summaries read by the dashboard, updated with each commit
+        ensure_aggregate_tables(cursor)
+        aggregates = Aggregates()
+        create_data_version_table(cursor)
+        # Fields of the MongoDB documents, with the ones copied from SQL
+        document_fields = mongodb_fields()
+        if c.MODO_TUBERIA and c.MODO_CARGA == "insert":
+            writer = PipelinedWriter(cursor, collection, sql_insertions)
+        else:
+            writer = WRITERS[c.MODO_CARGA](cursor, collection, sql_insertions)
 
-        reviewers = (
-            {}
-        )  # must be a dictionary to save the reviewer's name to keep the first one that appears
-        id_review = 1
-        for name in c.NOMBRE_FICHEROS_DATOS:
-            asins = []
-            path = os.path.join(c.DIRECTORIO_DATOS, name)
-            print(name[:-5])
-            with open(path, "r") as f:
-                for line in f:
-                    line = json.loads(line)
-
-                    # *** Data processing ***
-                    line["id"] = id_review
-
-                    line["type"] = name[:-5]
-
-                    # Set certain data to None
-                    for guide_list in c.GUIAS_TABLAS_SQL.values():
-                        for guide_data in guide_list:
-                            if guide_data not in line:
-                                line[guide_data] = None
-                            elif line[guide_data] in ["", " "]:
-                                line[guide_data] = None
-
-                    # Convert reviewTime to DATE format
-                    if line["reviewTime"] is not None:
-                        # Example of reviewTime: 04 22, 2014
-                        # We can see that the three elements are separated by spaces
-                        reviewtime = line["reviewTime"].split(" ")
-                        if len(reviewtime) == 3:
-                            month, day, year = reviewtime
-                            day = day.strip(
-                                ","
-                            )  # day is the one that kept the comma from registered
-                            line["reviewTime"] = f"{year}-{month}-{day}"
-                        else:  # if it is not correct, we set it to NULL
-                            line["reviewTime"] = None
-
-                    # Insert the reviewer if it has not already been created
-                    if line["reviewerID"] is not None:
-                        if line["reviewerID"] not in reviewers:  # in the reviewers keys
-                            reviewers[line["reviewerID"]] = line["reviewerName"]
-                            cursor.execute(
-                                sql_insertions[0],
+        try:
+            # Index of the reviewers and products already inserted. The reviewers keep the
+            # first name that appears
+            index = DedupIndex()
+            id_review = 1
+            if resume:
+                # Only what was committed with a checkpoint is kept
+                id_review = get_next_id(cursor)
+                discard_uncommitted(collection, id_review)
+                index.rebuild(cursor)
+
+            for name in c.NOMBRE_FICHEROS_DATOS:
+                path = os.path.join(c.DIRECTORIO_DATOS, name)
+                print(name[:-5])
+                PROFILER.start_file(name)
+                offset = 0
+                checkpoint = get_checkpoint(cursor, name) if resume else None
+                if checkpoint is not None:
+                    offset, id_review, _ = checkpoint
+
+                chunks = read_chunks(path, name[:-5], offset)
+                if c.MODO_TUBERIA:
+                    chunks = prefetch(chunks)
+                for n_chunk, (records, offset) in enumerate(chunks, 1):
+                    for line in records:
+                        # *** Data processing ***
+                        line["id"] = id_review
+
+                        # Insert the reviewer if it has not already been created
+                        t = perf_counter()
+                        new_reviewer = False
+                        if line["reviewerID"] is not None:
+                            if line["reviewerID"] not in index.reviewers:
+                                index.reviewers[line["reviewerID"]] = line[
+                                    "reviewerName"
+                                ]
+                                new_reviewer = True
+                            else:
+                                line["reviewerName"] = index.reviewers[
+                                    line["reviewerID"]
+                                ]
+                        PROFILER.record("reviewer_dedup", perf_counter() - t)
+                        if new_reviewer:
+                            writer.add_row(
+                                "reviewer",
                                 [
                                     line[guide_data]
                                     for guide_data in c.GUIAS_TABLAS_SQL["reviewer"]
                                 ],
                             )
-                        else:
-                            line["reviewerName"] = reviewers[line["reviewerID"]]
-
-                    # Insert the product if it has not already been done
-                    if line["asin"] is not None and line["asin"] not in asins:
-                        asins.append(line["asin"])
-                        cursor.execute(
-                            sql_insertions[1],
-                            [
-                                line[guide_data]
-                                for guide_data in c.GUIAS_TABLAS_SQL["product"]
-                            ],
+
+                        # Insert the product if it has not already been done
+                        t = perf_counter()
+                        product_key = (line["asin"], line["type"])
+                        new_product = (
+                            line["asin"] is not None
+                            and product_key not in index.products
                         )
+                        if new_product:
+                            index.products.add(product_key)
+                        PROFILER.record("product_dedup", perf_counter() - t)
+                        if new_product:
+                            writer.add_row(
+                                "product",
+                                [
+                                    line[guide_data]
+                                    for guide_data in c.GUIAS_TABLAS_SQL["product"]
+                                ],
+                            )
 
-                    # Create the reviews
-                    cursor.execute(
-                        sql_insertions[2],
-                        [
+                        # Create the reviews and count them in the summaries
+                        review_row = [
                             line[guide_data]
                             for guide_data in c.GUIAS_TABLAS_SQL["review"]
-                        ],
-                    )
+                        ]
+                        writer.add_row("review", review_row)
+                        aggregates.add(review_row)
+                        aggregates.add_terms(line["type"], line["summary"])
+
+                        writer.add_document(
+                            {
+                                guide_data: line[guide_data]
+                                for guide_data in document_fields
+                            }
+                        )
+
+                        id_review += 1
+
+                    # Commit the progress every TROZOS_POR_CHECKPOINT chunks
+                    if n_chunk % c.TROZOS_POR_CHECKPOINT == 0:
+                        writer.commit(
+                            save_checkpoint(name, offset, id_review),
+                            aggregates.apply,
+                            bump_data_version,
+                        )
+                        index.save(id_review - 1)
+
+                # The last checkpoint of a file covers it completely
+                writer.commit(
+                    save_checkpoint(name, offset, id_review),
+                    aggregates.apply,
+                    bump_data_version,
+                )
+                index.save(id_review - 1)
+        finally:
+            # The threads of the pipelined writer are stopped also if the load fails
+            writer.close()
+        cursor.close()
+        index.close()
+        writer.report()
+        PROFILER.finish()
+    return writer.stats
+
+
+# Tables are created without keys. The keys and indexes are added before the load, or
+# after it when CARGA_RAPIDA is enabled so that the inserts do not have to maintain them
+SQL_TABLES = [
+    """
+    CREATE TABLE reviewer (
+        reviewerID VARCHAR(40) NOT NULL,
+        reviewerName TEXT
+    );""",
+    """
+    CREATE TABLE product (
+        asin VARCHAR(40) NOT NULL,
+        type VARCHAR(80) NOT NULL
+    );""",
+    """
+    CREATE TABLE review (
+        id INT NOT NULL,
+        reviewerID VARCHAR(40),
+        asin VARCHAR(40),
+        type VARCHAR(80),
+        overall INT,
+        unixReviewTime INT,
+        reviewTime DATE,
+        review_year SMALLINT AS (YEAR(reviewTime)) STORED
+    );""",
+]
+SQL_PRIMARY_KEYS = [
+    "ALTER TABLE reviewer ADD PRIMARY KEY (reviewerID);",
+    "ALTER TABLE product ADD PRIMARY KEY (asin, type);",
+]
+SQL_REVIEW_PRIMARY_KEY = "ALTER TABLE review ADD PRIMARY KEY (id);"
+SQL_FOREIGN_KEYS = [
+    """ALTER TABLE review
+        ADD FOREIGN KEY (reviewerID) REFERENCES reviewer(reviewerID),
+        ADD FOREIGN KEY (asin, type) REFERENCES product(asin, type);""",
+]
+
+# Counts the reviews whose reviewer or product does not exist in a single pass over review
+SQL_ORPHANS = """SELECT SUM(r.reviewerID IS NOT NULL AND rv.reviewerID IS NULL),
+                        SUM(r.asin IS NOT NULL AND r.type IS NOT NULL AND p.asin IS NULL)
+                    FROM review r
+                    LEFT JOIN reviewer rv ON rv.reviewerID = r.reviewerID
+                    LEFT JOIN product p ON p.asin = r.asin AND p.type = r.type;"""
+
+
+def create_sql_keys(validate: bool = False) -> None:
+    """Adds the primary keys, secondary indexes and foreign keys to the tables.
+
+    Args:
+        validate (bool, optional): whether to check the referential integrity of the loaded
+            data before adding the foreign keys, which are then added without checking
+            them again. Defaults to False.
+
+    Raises:
+        Exception: if there are reviews whose reviewer or product does not exist
+    """
+    mysql_connection = pymysql.connect(
+        host="localhost",
+        user=c.USUARIO_SQL,
+        password=c.PASSWORD_SQL,
+        database=c.NOMBRE_BASE_SQL,
+    )
 
-                    collection.insert_one(
-                        {
-                            guide_data: line[guide_data]
-                            for guide_data in c.GUIA_TABLA_MONGODB
-                        }
-                    )
+    with mysql_connection:
+        cursor = mysql_connection.cursor()
 
-                    id_review += 1
+        # The primary keys of reviewer and product are needed by the validation
+        for sql in SQL_PRIMARY_KEYS:
+            cursor.execute(sql)
+        if c.PARTICIONAR_RESENAS:
+            cursor.execute(SQL_PARTITIONED_PRIMARY_KEY)
+        else:
+            cursor.execute(SQL_REVIEW_PRIMARY_KEY)
+
+        if validate:
+            cursor.execute(SQL_ORPHANS)
+            orphan_reviewers, orphan_products = cursor.fetchone()
+            if orphan_reviewers or orphan_products:
+                raise Exception(
+                    f"Referential integrity check failed: {orphan_reviewers or 0} reviews "
+                    f"without reviewer and {orphan_products or 0} reviews without product"
+                )
+
+        # The secondary indexes are listed in sql_indexes.py
+        create_sql_indexes(cursor, ["reviewer", "product", "review"])
+
+        # A partitioned table cannot have foreign keys, so only the validation checks them
+        if not c.PARTICIONAR_RESENAS:
+            if validate:
+                cursor.execute("SET foreign_key_checks = 0;")
+            for sql in SQL_FOREIGN_KEYS:
+                cursor.execute(sql)
 
-        mysql_connection_table.commit()
+        mysql_connection.commit()
         cursor.close()
 
 
-def load_data():
-    """Creates the databases and cleans and loads the data into them."""
-    sql_tables = [
-        """
-        CREATE TABLE reviewer (
-            reviewerID VARCHAR(40) NOT NULL,
-            reviewerName TEXT,
-            PRIMARY KEY (reviewerID)
-        );""",
-        """
-        CREATE TABLE product (
-            asin VARCHAR(40) NOT NULL,
-            type VARCHAR(80) NOT NULL,
-            PRIMARY KEY (asin, type)
-        );""",
-        """
-        CREATE TABLE review (
-            id INT NOT NULL,
-            reviewerID VARCHAR(40),
-            asin VARCHAR(40),
-            type VARCHAR(80),
-            overall INT,
-            unixReviewTime INT,
-            reviewTime VARCHAR(50),
-            PRIMARY KEY (id),
-            FOREIGN KEY (reviewerID) REFERENCES reviewer(reviewerID),
-            FOREIGN KEY (asin, type) REFERENCES product(asin, type)
-        );""",
-    ]
-    create_sql_database()
-    for sql in sql_tables:
-        create_sql_table(sql)
-    create_mongodb_database()
-
-    clean_data()
+def load_data(resume: bool = False) -> dict:
+    """Creates the databases and cleans and loads the data into them.
+
+    Args:
+        resume (bool, optional): keep the databases and continue the load from the last
+            checkpoints. Defaults to False.
+
+    Returns:
+        dict: rows written and seconds spent by each sink, and by the keys if they are
+              created after the load
+    """
+    if not resume:
+        create_sql_database()
+        for sql in SQL_TABLES:
+            create_sql_table(sql)
+        if c.PARTICIONAR_RESENAS:
+            # One partition for the type of each file, taken from its name
+            create_sql_table(
+                sql_partition_review([name[:-5] for name in c.NOMBRE_FICHEROS_DATOS])
+            )
+        if not c.CARGA_RAPIDA:
+            create_sql_keys()
+        create_mongodb_database()
+
+    stats = clean_data(resume)
+
+    if c.CARGA_RAPIDA:
+        t = perf_counter()
+        create_sql_keys(validate=True)
+        client = MongoClient("mongodb://localhost:27017")
+        create_mongodb_indexes(client[c.NOMBRE_BASE_MONGODB][c.NOMBRE_TABLA_MONGODB])
+        stats["keys"] = {"rows": 0, "time": perf_counter() - t}
+    return stats
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates and loads the databases")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted load from its last checkpoint",
+    )
+    args = parser.parse_args()
+
     t = perf_counter()
-    load_data()
-    print(f"Time to load data: {perf_counter() - t}")
+    load_data(args.resume)
+    print(f"Time to load data ({c.MODO_CARGA}): {perf_counter() - t}")
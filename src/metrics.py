@@ -0,0 +1,369 @@
+"""
+================
+metrics.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the metrics of dashboard.py, so it can be seen which graph makes the
+dashboard slow. Each request of a callback is timed with the bytes it returns, and each SQL
+query is timed with the rows it returns and whether the cache answered it, all of them
+labelled with the callback that made them. They are shown in the Prometheus text format in
+the /metrics route of the server with the use of the SQL connection pool, and the slow
+queries can also be written to a file.
+
+Regarding the configuration parameters, the slow queries are written to
+FICHERO_CONSULTAS_LENTAS (None to not write them) when they take more than
+UMBRAL_CONSULTA_LENTA seconds.
+"""
+
+import config as c
+import connection_pool
+import json
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+from threading import Lock, local
+from time import perf_counter
+from flask import Response, request
+from query_cache import normalize_sql
+
+# Upper bounds of the buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Name of each metric: (type, description)
+METRIC_DESCRIPTIONS = {
+    "dashboard_request_seconds": (
+        "histogram",
+        "Time to answer a callback or the layout",
+    ),
+    "dashboard_response_bytes_total": (
+        "counter",
+        "Bytes returned by the callbacks and the layout",
+    ),
+    "dashboard_query_seconds": (
+        "histogram",
+        "Time of the SQL queries sent to the server",
+    ),
+    "dashboard_query_rows_total": (
+        "counter",
+        "Rows returned by the SQL queries sent to the server",
+    ),
+    "dashboard_cache_requests_total": (
+        "counter",
+        "Lookups in the caches of queries and figures, by result",
+    ),
+}
+
+# Statistics of the SQL connection pool exported: (metric, type, description)
+POOL_METRICS = {
+    "size": ("dashboard_sql_pool_connections", "gauge", "SQL connections open"),
+    "idle": ("dashboard_sql_pool_idle_connections", "gauge", "SQL connections free"),
+    "checkouts": (
+        "dashboard_sql_pool_checkouts_total",
+        "counter",
+        "Connections taken from the pool",
+    ),
+    "created": (
+        "dashboard_sql_pool_created_total",
+        "counter",
+        "Connections opened by the pool",
+    ),
+    "reconnects": (
+        "dashboard_sql_pool_reconnects_total",
+        "counter",
+        "Connections opened again because they stopped working",
+    ),
+    "wait_total": (
+        "dashboard_sql_pool_wait_seconds_total",
+        "counter",
+        "Seconds waited for a connection",
+    ),
+    "wait_max": (
+        "dashboard_sql_pool_wait_seconds_max",
+        "gauge",
+        "Longest wait for a connection, in seconds",
+    ),
+}
+
+
+class Histogram:
+    """
+    Counts of the values observed in each bucket, with their sum
+
+    Args:
+        buckets (tuple): upper bounds of the buckets, in increasing order
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # The last one counts the values above every bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Adds a value
+
+        Args:
+            value (float): the value
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels) -> str:
+    """
+    Returns labels in the Prometheus format
+
+    Args:
+        labels (tuple): (name, value) pairs
+
+    Returns:
+        str: the labels between braces, or an empty string if there are none
+    """
+    if not labels:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class DashboardMetrics:
+    """
+    Metrics of the requests and queries of the dashboard. The callback being answered is
+    kept per thread, since the server answers each request in its own thread, so the
+    queries are labelled with it
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.local = local()
+        # (metric, labels) -> Histogram
+        self.histograms = {}
+        # (metric, labels) -> value
+        self.counters = Counter()
+        self.slow_log_lock = Lock()
+
+    def current(self) -> str:
+        """
+        Returns the callback answered by this thread
+
+        Returns:
+            str: its name, or "other" outside a request
+        """
+        return getattr(self.local, "callback", None) or "other"
+
+    def observe(self, metric, labels, value):
+        """
+        Adds a value to a histogram
+
+        Args:
+            metric (str): the name of the metric
+            labels (tuple): its (name, value) labels
+            value (float): the value
+        """
+        with self.lock:
+            key = (metric, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(LATENCY_BUCKETS)
+            self.histograms[key].observe(value)
+
+    def increment(self, metric, labels, value=1):
+        """
+        Increases a counter
+
+        Args:
+            metric (str): the name of the metric
+            labels (tuple): its (name, value) labels
+            value (int, optional): the increase. Defaults to 1.
+        """
+        with self.lock:
+            self.counters[(metric, labels)] += value
+
+    def cache_lookup(self, cache, hit):
+        """
+        Counts a lookup in a cache
+
+        Args:
+            cache (str): the name of the cache
+            hit (bool): whether the result was stored
+        """
+        labels = (
+            ("callback", self.current()),
+            ("cache", cache),
+            ("result", "hit" if hit else "miss"),
+        )
+        self.increment("dashboard_cache_requests_total", labels)
+
+    def queries(self, function):
+        """
+        Returns a version of function(sql, data=None), a query behind the query cache,
+        that counts the hits and misses of the cache
+
+        Args:
+            function (function): the cached function that runs a query
+
+        Returns:
+            function: the function with the lookups counted
+        """
+
+        def instrumented(sql, data=None):
+            self.local.executed = False
+            result = function(sql, data)
+            self.cache_lookup("query", not self.local.executed)
+            return result
+
+        instrumented.__doc__ = function.__doc__
+        return instrumented
+
+    def query_executed(self, sql, data, seconds, rows):
+        """
+        Records a query sent to the server, writing it to the slow query log if it
+        took more than UMBRAL_CONSULTA_LENTA seconds
+
+        Args:
+            sql (str): the SQL query
+            data (list): the parameters of the query
+            seconds (float): the time it took
+            rows (int): the rows it returned
+        """
+        self.local.executed = True
+        labels = (("callback", self.current()),)
+        self.observe("dashboard_query_seconds", labels, seconds)
+        self.increment("dashboard_query_rows_total", labels, rows)
+        if c.FICHERO_CONSULTAS_LENTAS and seconds > c.UMBRAL_CONSULTA_LENTA:
+            entry = {
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "callback": self.current(),
+                "seconds": round(seconds, 4),
+                "rows": rows,
+                "sql": normalize_sql(sql),
+                "parameters": data,
+            }
+            with self.slow_log_lock:
+                with open(c.FICHERO_CONSULTAS_LENTAS, "a") as f:
+                    f.write(json.dumps(entry, default=str) + "\n")
+
+    def start_request(self, callback):
+        """
+        Starts timing a request
+
+        Args:
+            callback (str): the callback answered, or None if the request is not recorded
+        """
+        self.local.callback = callback
+        self.local.start = perf_counter()
+
+    def finish_request(self, size):
+        """
+        Records the request started by this thread
+
+        Args:
+            size (int): bytes of the response
+        """
+        callback = getattr(self.local, "callback", None)
+        if callback is None:
+            return
+        labels = (("callback", callback),)
+        self.observe(
+            "dashboard_request_seconds", labels, perf_counter() - self.local.start
+        )
+        self.increment("dashboard_response_bytes_total", labels, size)
+        self.local.callback = None
+
+    def prometheus(self) -> str:
+        """
+        Returns the metrics in the Prometheus text format
+
+        Returns:
+            str: the metrics
+        """
+        with self.lock:
+            histograms = {
+                key: (list(h.counts), h.sum, h.count)
+                for key, h in self.histograms.items()
+            }
+            counters = dict(self.counters)
+        lines = []
+        for metric, (kind, description) in METRIC_DESCRIPTIONS.items():
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {kind}")
+            if kind == "histogram":
+                for (name, labels), (counts, total, count) in sorted(
+                    histograms.items()
+                ):
+                    if name != metric:
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                        cumulative += n
+                        bucket = format_labels(labels + (("le", bound),))
+                        lines.append(f"{metric}_bucket{bucket} {cumulative}")
+                    lines.append(f"{metric}_sum{format_labels(labels)} {total}")
+                    lines.append(f"{metric}_count{format_labels(labels)} {count}")
+            else:
+                for (name, labels), value in sorted(counters.items()):
+                    if name == metric:
+                        lines.append(f"{metric}{format_labels(labels)} {value}")
+        # The pool is only exported once a query has created it
+        if connection_pool.pool is not None:
+            pool = connection_pool.pool.summary()
+            for key, (metric, kind, description) in POOL_METRICS.items():
+                lines.append(f"# HELP {metric} {description}")
+                lines.append(f"# TYPE {metric} {kind}")
+                lines.append(f"{metric} {pool[key]}")
+        return "\n".join(lines) + "\n"
+
+
+# Metrics of the process
+METRICS = DashboardMetrics()
+
+
+def request_callback():
+    """
+    Returns the name of what the current request of the server answers
+
+    Returns:
+        str: the id of the first output of a callback, "layout", or None for the other
+             requests (files, /metrics...)
+    """
+    if request.path.endswith("/_dash-update-component"):
+        body = request.get_json(silent=True) or {}
+        # e.g. "graph-1.figure", or "..graph-1.figure...graph-2.figure.." with several
+        output = body.get("output", "").lstrip(".").split(".")[0]
+        return output or "callback"
+    if request.path.endswith("/_dash-layout"):
+        return "layout"
+    return None
+
+
+def install_metrics(app) -> None:
+    """
+    Records the requests of the server of a Dash app and adds the /metrics route to it
+
+    Args:
+        app (Dash): the app
+    """
+    server = app.server
+
+    @server.before_request
+    def start_request():
+        METRICS.start_request(request_callback())
+
+    @server.after_request
+    def finish_request(response):
+        METRICS.finish_request(response.calculate_content_length() or 0)
+        return response
+
+    def metrics():
+        return Response(METRICS.prometheus(), mimetype="text/plain; version=0.0.4")
+
+    server.add_url_rule("/metrics", "metrics", metrics)
@@ -0,0 +1,95 @@
+"""
+================
+migrations.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the changes to the schema of a database created by an older version of
+load_data.py. Running it changes reviewTime from VARCHAR to DATE and adds the review_year
+column, so the queries grouped by year read a range of an index instead of converting
+reviewTime in every row. The secondary indexes of sql_indexes.py that are missing or
+changed are created, and the summary tables are rebuilt afterwards.
+
+Regarding the configuration parameters, there are none.
+"""
+
+import config as c
+import pymysql
+from aggregates import ensure_aggregate_tables, rebuild_aggregates
+from data_version import create_data_version_table, bump_data_version
+from sql_indexes import create_sql_indexes
+from time import perf_counter
+
+SQL_MIGRATE_REVIEW_TIME = [
+    # The dates that cannot be read become NULL instead of stopping the migration
+    "SET SESSION sql_mode = '';",
+    """UPDATE review
+        SET reviewTime = DATE_FORMAT(STR_TO_DATE(reviewTime, '%Y-%m-%d'), '%Y-%m-%d');""",
+    """ALTER TABLE review
+        MODIFY reviewTime DATE,
+        ADD COLUMN review_year SMALLINT AS (YEAR(reviewTime)) STORED;""",
+]
+
+
+def review_time_type(cursor) -> str:
+    """
+    Returns the type of the reviewTime column
+
+    Args:
+        cursor: cursor of the SQL connection
+
+    Returns:
+        str: the type, e.g. varchar or date
+    """
+    cursor.execute(
+        """SELECT data_type
+            FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'review'
+                AND column_name = 'reviewTime';"""
+    )
+    return cursor.fetchone()[0].lower()
+
+
+def migrate_review_time(cursor) -> bool:
+    """
+    Changes reviewTime to DATE and adds review_year if it was not done before
+
+    Args:
+        cursor: cursor of the SQL connection
+
+    Returns:
+        bool: True if the table was changed
+    """
+    if review_time_type(cursor) == "date":
+        return False
+    for sql in SQL_MIGRATE_REVIEW_TIME:
+        cursor.execute(sql)
+    return True
+
+
+if __name__ == "__main__":
+    mysql_connection = pymysql.connect(
+        host="localhost",
+        user=c.USUARIO_SQL,
+        password=c.PASSWORD_SQL,
+        database=c.NOMBRE_BASE_SQL,
+    )
+
+    t = perf_counter()
+    with mysql_connection:
+        cursor = mysql_connection.cursor()
+        migrated = migrate_review_time(cursor)
+        print("reviewTime migrated" if migrated else "reviewTime is already a DATE")
+        changed = create_sql_indexes(cursor, ["reviewer", "product", "review"])
+        print(f"Indexes created or replaced: {', '.join(changed) or 'none'}")
+        # Creates the summary tables that are missing, with their indexes
+        ensure_aggregate_tables(cursor)
+        if migrated:
+            # The years of the summaries are taken from review_year now
+            create_data_version_table(cursor)
+            rebuild_aggregates(cursor)
+            bump_data_version(cursor)
+            mysql_connection.commit()
+        cursor.close()
+    print(f"Migration finished in {perf_counter() - t:.2f} s")
@@ -0,0 +1,104 @@
+"""
+================
+mongodb_fields.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the fields of review that are copied to the MongoDB documents and the
+indexes of the collection, so the texts of a category can be read with one indexed query
+instead of getting the ids from SQL first. Running it fills the copied fields of the
+documents of an existing database and creates the indexes.
+
+Regarding the configuration parameters, the copied fields are CAMPOS_DESNORMALIZADOS_MONGODB.
+"""
+
+import config as c
+import pymysql
+from pymongo import MongoClient, UpdateOne
+from pymysql.cursors import SSCursor
+from time import perf_counter
+
+# Documents updated at a time by the backfill
+BACKFILL_SIZE = 10000
+
+
+def mongodb_fields() -> list:
+    """
+    Returns the fields of the MongoDB documents
+
+    Returns:
+        list: the fields of GUIA_TABLA_MONGODB followed by the copied ones
+    """
+    return c.GUIA_TABLA_MONGODB + [
+        field
+        for field in c.CAMPOS_DESNORMALIZADOS_MONGODB
+        if field not in c.GUIA_TABLA_MONGODB
+    ]
+
+
+def create_mongodb_indexes(collection) -> None:
+    """
+    Creates the indexes of the review collection if they do not exist: id, used to
+    match the documents with SQL, and type if it is one of the copied fields
+
+    Args:
+        collection: MongoDB collection of the reviews
+    """
+    collection.create_index("id")
+    if "type" in c.CAMPOS_DESNORMALIZADOS_MONGODB:
+        collection.create_index("type")
+
+
+def backfill(cursor, collection) -> int:
+    """
+    Copies the fields of CAMPOS_DESNORMALIZADOS_MONGODB from SQL to the documents that
+    already exist, and creates the indexes
+
+    Args:
+        cursor: cursor of the SQL connection
+        collection: MongoDB collection of the reviews
+
+    Returns:
+        int: number of documents modified
+    """
+    fields = c.CAMPOS_DESNORMALIZADOS_MONGODB
+    # The id index is needed by the updates
+    create_mongodb_indexes(collection)
+    if not fields:
+        return 0
+    modified = 0
+    # The reviews are streamed from the server instead of fetched all at once
+    with cursor.connection.cursor(SSCursor) as review_cursor:
+        review_cursor.execute(f"SELECT id, {', '.join(fields)} FROM review;")
+        while rows := review_cursor.fetchmany(BACKFILL_SIZE):
+            result = collection.bulk_write(
+                [
+                    UpdateOne({"id": row[0]}, {"$set": dict(zip(fields, row[1:]))})
+                    for row in rows
+                ],
+                ordered=False,
+            )
+            modified += result.modified_count
+    return modified
+
+
+if __name__ == "__main__":
+    mysql_connection = pymysql.connect(
+        host="localhost",
+        user=c.USUARIO_SQL,
+        password=c.PASSWORD_SQL,
+        database=c.NOMBRE_BASE_SQL,
+    )
+
+    # Create the connection to the database
+    CONNECTION_STRING = "mongodb://localhost:27017"
+    client = MongoClient(CONNECTION_STRING)
+    collection = client[c.NOMBRE_BASE_MONGODB][c.NOMBRE_TABLA_MONGODB]
+
+    t = perf_counter()
+    with mysql_connection:
+        cursor = mysql_connection.cursor()
+        modified = backfill(cursor, collection)
+        cursor.close()
+    print(f"{modified} documents updated in {perf_counter() - t:.2f} s")
@@ -15,20 +15,15 @@ container is running.
 from neo4j import GraphDatabase
 import pandas as pd
 import os
-import pymysql
 import config as c
 import random
+from connection_pool import get_pool
 
 # neo4j driver connection
 driver = GraphDatabase.driver(c.URI, auth=(c.USUARIO_NEO, c.PASSWORD_NEO))
 
-# SQL connection
-mysql_connection = pymysql.connect(
-    host="localhost",
-    user=c.USUARIO_SQL,
-    password=c.PASSWORD_SQL,
-    database=c.NOMBRE_BASE_SQL,  # User
-)
+# The SQL queries take their connection from the pool shared with the other modules, so
+# the exercises can run one after another in the same process
 
 # Auxiliary functions
 
@@ -58,8 +53,7 @@ def create_nodes(func):
             res = result.data()
             print(res)
             # We get the queries to create the database
-            with mysql_connection:
-                query, extra_query = func(*args, **kwargs)
+            query, extra_query = func(*args, **kwargs)
             # We execute them and show all the data of the reviewers
             session.run(query)
             query = """
@@ -114,16 +108,17 @@ def get_users(n_users=c.N_USUARIOS_NEO):
                     list of users without repetitions
     """
 
-    cursor = mysql_connection.cursor()
+    # The reviews of each reviewer are counted in agg_reviewer (see aggregates.py)
     sql = """SELECT r.reviewerID, r.asin
                 FROM review r
                 INNER JOIN (SELECT reviewerID
-                                    FROM review
-                                    GROUP BY reviewerID
-                                    ORDER BY COUNT(*) DESC
+                                    FROM agg_reviewer
+                                    ORDER BY reviews DESC
                                     LIMIT %s) as t ON r.reviewerID = t.reviewerID;"""
-    cursor.execute(sql, n_users)
-    data = cursor.fetchall()
+    with get_pool().connection() as mysql_connection:
+        cursor = mysql_connection.cursor()
+        cursor.execute(sql, n_users)
+        data = cursor.fetchall()
     users, products = list(zip(*data))
     user_prod = {}
     for user, asin in zip(users, products):
@@ -141,12 +136,13 @@ def get_all_asins():
         list: the list with all the asins
     """
 
-    cursor = mysql_connection.cursor()
     sql = """SELECT DISTINCT asin
             FROM product
             """
-    cursor.execute(sql)
-    data = cursor.fetchall()
+    with get_pool().connection() as mysql_connection:
+        cursor = mysql_connection.cursor()
+        cursor.execute(sql)
+        data = cursor.fetchall()
     return list(data)
 
 
@@ -161,12 +157,13 @@ def get_articles(articles):
                     the distinct users
     """
 
-    cursor = mysql_connection.cursor()
     sql = """SELECT asin, reviewerID, reviewTime, overall
                 FROM review
                 WHERE asin IN %s"""
-    cursor.execute(sql, [articles])
-    data = cursor.fetchall()
+    with get_pool().connection() as mysql_connection:
+        cursor = mysql_connection.cursor()
+        cursor.execute(sql, [articles])
+        data = cursor.fetchall()
     data = list(zip(*data))
     users = list(set(data[1]))
 
@@ -185,7 +182,6 @@ def get_users_and_types(n_users=c.N_USUARIOS_NEO_EJ3):
                           contains the data of how many reviews each user has
                           done for each type
     """
-    cursor = mysql_connection.cursor()
     sql = """SELECT reviewerID, type, COUNT(*)
             FROM review r 
             WHERE reviewerID in (SELECT r2.reviewerID
@@ -198,8 +194,10 @@ def get_users_and_types(n_users=c.N_USUARIOS_NEO_EJ3):
                                 HAVING COUNT(DISTINCT type) > 1)
             GROUP BY reviewerID, type;
                  """
-    cursor.execute(sql, n_users)
-    data = cursor.fetchall()
+    with get_pool().connection() as mysql_connection:
+        cursor = mysql_connection.cursor()
+        cursor.execute(sql, n_users)
+        data = cursor.fetchall()
     users, types, _ = list(zip(*data))
     users = list(set(users))
     types = list(set(types))
@@ -216,7 +214,6 @@ def popular_articles():
         list, list, list: the unique users and products respectively followed by the
                           data of which reviewer has reviewed which products
     """
-    cursor = mysql_connection.cursor()
     sql = """SELECT reviewerID, r.asin
              FROM review r
              INNER JOIN (SELECT asin
@@ -227,8 +224,10 @@ def popular_articles():
                             LIMIT 5) AS r2 on r.asin = r2.asin
 
                  """
-    cursor.execute(sql)
-    data = cursor.fetchall()
+    with get_pool().connection() as mysql_connection:
+        cursor = mysql_connection.cursor()
+        cursor.execute(sql)
+        data = cursor.fetchall()
     users, products = list(zip(*data))
     users = list(set(users))
     products = list(set(products))
@@ -0,0 +1,72 @@
+"""
+================
+normalization.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file cleans the reviews read by load_data.py and insert_dataset.py. It works on
+blocks of reviews as columns with pandas, so the cleaning is not done field by field in
+Python for every review.
+"""
+
+import config as c
+import pandas as pd
+
+
+# Every field that goes to SQL, without repetitions
+SQL_FIELDS = list(
+    dict.fromkeys(
+        guide_data
+        for guide_list in c.GUIAS_TABLAS_SQL.values()
+        for guide_data in guide_list
+    )
+)
+
+# Example of reviewTime: 04 22, 2014. It must have exactly three elements separated by spaces
+REVIEW_TIME = r"^([^ ]*) ([^ ]*) ([^ ]*)$"
+
+
+def normalize_block(records: list, file_type: str) -> list:
+    """
+    Cleans a block of parsed reviews: sets the type, fills the missing SQL fields and
+    the empty ones with None and converts reviewTime to DATE format
+
+    Args:
+        records (list): the parsed reviews
+        file_type (str): the product type, taken from the file name
+
+    Returns:
+        list: the cleaned reviews, in the same order
+    """
+    if not records:
+        return []
+
+    df = pd.DataFrame.from_records(records)
+    df["type"] = file_type
+    for guide_data in SQL_FIELDS + c.GUIA_TABLA_MONGODB:
+        if guide_data not in df:
+            df[guide_data] = None
+
+    # If a review has no time the column becomes float, so it is made integer again
+    if df["unixReviewTime"].dtype.kind == "f":
+        df["unixReviewTime"] = df["unixReviewTime"].astype("Int64")
+    df = df.astype(object)
+
+    # Set certain data to None
+    df[SQL_FIELDS] = df[SQL_FIELDS].mask(df[SQL_FIELDS].isin(["", " "]))
+
+    # Convert reviewTime to DATE format, the ones that are not correct are set to NULL
+    month, day, year = [
+        part for _, part in df["reviewTime"].str.extract(REVIEW_TIME).items()
+    ]
+    # day is the one that kept the comma from registered. The dates that do not exist
+    # are set to NULL too, since the column is a DATE
+    review_time = pd.to_datetime(
+        year + "-" + month + "-" + day.str.strip(","),
+        format="%Y-%m-%d",
+        errors="coerce",
+    )
+    df["reviewTime"] = review_time.dt.strftime("%Y-%m-%d")
+
+    return df.where(df.notna(), None).to_dict("records")
@@ -0,0 +1,191 @@
+"""
+================
+partitions.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the partitions of the review table by product type. With them, a query
+of one type only reads the partition of that type, and the reviews of a type are removed
+by emptying its partition instead of deleting them row by row. load_data.py creates one
+partition for the type of each file and insert_dataset.py adds the one of a new file.
+Running it removes the reviews of a type, so its file can be loaded again.
+
+Regarding the configuration parameters, the partitions are used if PARTICIONAR_RESENAS is
+enabled when the database is created. A partitioned review table cannot have foreign keys,
+so the references of its reviews are only checked with CARGA_RAPIDA.
+"""
+
+import config as c
+import argparse
+import re
+import pymysql
+from pymongo import MongoClient
+from aggregates import rebuild_aggregates
+from data_version import bump_data_version
+from dedup_index import DedupIndex
+
+# The primary key of a partitioned table must contain the column of the partitions
+SQL_PARTITIONED_PRIMARY_KEY = "ALTER TABLE review ADD PRIMARY KEY (id, type);"
+
+# Summary tables with one row per type, emptied with the partition
+TYPE_AGGREGATES = ["agg_type_year", "agg_rating", "agg_term"]
+
+
+def partition_name(review_type: str) -> str:
+    """
+    Returns the name of the partition of a type
+
+    Args:
+        review_type (str): the product type
+
+    Returns:
+        str: the name of the partition
+    """
+    return "p_" + re.sub(r"\W", "_", review_type)
+
+
+def partition_definition(review_type: str) -> str:
+    """
+    Returns the definition of the partition of a type
+
+    Args:
+        review_type (str): the product type
+
+    Returns:
+        str: the definition, to be used in PARTITION BY or ADD PARTITION
+    """
+    value = pymysql.converters.escape_string(review_type)
+    return f"PARTITION {partition_name(review_type)} VALUES IN ('{value}')"
+
+
+def sql_partition_review(types: list) -> str:
+    """
+    Returns the query that partitions the review table with one partition per type
+
+    Args:
+        types (list): the product types
+
+    Returns:
+        str: the SQL query
+    """
+    partitions = ",\n        ".join(partition_definition(t) for t in types)
+    return f"""ALTER TABLE review
+        PARTITION BY LIST COLUMNS (type) (
+        {partitions}
+    );"""
+
+
+def review_partitions(cursor) -> set:
+    """
+    Returns the partitions of the review table
+
+    Args:
+        cursor: cursor of the SQL connection
+
+    Returns:
+        set: the names of the partitions, empty if the table is not partitioned
+    """
+    cursor.execute(
+        """SELECT partition_name
+            FROM information_schema.partitions
+            WHERE table_schema = DATABASE() AND table_name = 'review'
+                AND partition_name IS NOT NULL;"""
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def add_type_partition(cursor, review_type: str) -> bool:
+    """
+    Adds the partition of a type to the review table if it is partitioned and the type
+    does not have one. It changes the table, so it must not be called inside a load
+
+    Args:
+        cursor: cursor of the SQL connection
+        review_type (str): the product type
+
+    Returns:
+        bool: True if the partition was added
+    """
+    partitions = review_partitions(cursor)
+    if not partitions or partition_name(review_type) in partitions:
+        return False
+    cursor.execute(
+        f"ALTER TABLE review ADD PARTITION ({partition_definition(review_type)});"
+    )
+    return True
+
+
+def clear_type(cursor, collection, review_type: str) -> None:
+    """
+    Removes the reviews of a type: their partition is emptied and their products, summaries,
+    MongoDB documents and checkpoint are deleted. The reviewers are kept, since they may
+    have reviews of other types. If it is interrupted it can be run again
+
+    Args:
+        cursor: cursor of the SQL connection
+        collection: MongoDB collection of the reviews
+        review_type (str): the product type
+
+    Raises:
+        Exception: if review is not partitioned by type, the MongoDB documents do not
+                   have the type or a load is running
+    """
+    name = partition_name(review_type)
+    if name not in review_partitions(cursor):
+        raise Exception(f"The review table has no partition for {review_type}")
+    if "type" not in c.CAMPOS_DESNORMALIZADOS_MONGODB:
+        raise Exception(
+            "The documents of a type cannot be found without the type in MongoDB"
+        )
+
+    # The saved index must lose the products of the type, so no load may own it meanwhile
+    index = DedupIndex.load()
+    if not index.owner:
+        index.close()
+        raise Exception("A load is running, the type can be removed when it finishes")
+
+    cursor.execute(f"ALTER TABLE review TRUNCATE PARTITION {name};")
+    cursor.execute("DELETE FROM product WHERE type = %s;", review_type)
+    for table in TYPE_AGGREGATES:
+        cursor.execute(f"DELETE FROM {table} WHERE type = %s;", review_type)
+    # The reviewers of the type may have reviews of other types, so they are counted again
+    rebuild_aggregates(cursor, ["agg_reviewer"])
+    cursor.execute(
+        "DELETE FROM ingest_checkpoint WHERE file = %s;", f"{review_type}.json"
+    )
+    bump_data_version(cursor)
+    cursor.connection.commit()
+
+    collection.delete_many({"type": review_type})
+
+    # The products of the type must be inserted again when its file is loaded
+    index.products = {key for key in index.products if key[1] != review_type}
+    index.save(index.last_id)
+    index.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Removes the reviews of a product type from the databases"
+    )
+    parser.add_argument("type", help="the product type, e.g. Video_Games_5")
+    args = parser.parse_args()
+
+    mysql_connection = pymysql.connect(
+        host="localhost",
+        user=c.USUARIO_SQL,
+        password=c.PASSWORD_SQL,
+        database=c.NOMBRE_BASE_SQL,
+    )
+
+    # Create the connection to the database
+    CONNECTION_STRING = "mongodb://localhost:27017"
+    client = MongoClient(CONNECTION_STRING)
+    collection = client[c.NOMBRE_BASE_MONGODB][c.NOMBRE_TABLA_MONGODB]
+
+    with mysql_connection:
+        cursor = mysql_connection.cursor()
+        clear_type(cursor, collection, args.type)
+        cursor.close()
+    print(f"Reviews of {args.type} removed")
@@ -0,0 +1,234 @@
+"""
+================
+pipeline.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the pipelined mode of load_data.py and insert_dataset.py. The file
+is read and parsed in one thread, the rows are prepared in the main one and SQL and
+MongoDB are written by one thread each. The stages are connected by bounded queues, so a
+slow stage makes the others wait instead of filling the memory.
+
+Regarding the configuration parameters, it is enabled with MODO_TUBERIA and the size of
+the queues is TAMANO_COLA.
+"""
+
+import config as c
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+from batch_writer import BatchWriter
+from profiler import PROFILER
+
+
+def prefetch(iterable, size=None):
+    """
+    Consumes an iterable in a separate thread, keeping at most size items ready
+
+    Args:
+        iterable: the iterable to consume, e.g. the chunks of read_chunks
+        size (int, optional): maximum items waiting. Defaults to TAMANO_COLA.
+
+    Yields:
+        the items of the iterable, in the same order
+    """
+    queue = Queue(size or c.TAMANO_COLA)
+    end = object()
+
+    def run():
+        try:
+            for item in iterable:
+                queue.put(item)
+        except BaseException as e:
+            queue.put(e)
+        queue.put(end)
+
+    Thread(target=run, daemon=True).start()
+    while (item := queue.get()) is not end:
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
+class PipelinedWriter(BatchWriter):
+    """
+    BatchWriter that writes SQL and MongoDB from two threads, so both databases work at
+    the same time. The full buffers are sent to the threads through bounded queues, and
+    the depth of the queues is recorded to see which database is the bottleneck
+
+    Args:
+        cursor: cursor of the SQL connection used for the load. Once the writer is created
+                only its SQL thread may use it
+        collection: MongoDB collection where the documents are inserted
+        sql_insertions (dict): parameterized INSERT query of each table
+        batch_size (int, optional): rows kept in each buffer before writing them.
+                                    Defaults to TAMANO_LOTE.
+        queue_size (int, optional): batches waiting in each queue. Defaults to TAMANO_COLA.
+        shared_cursor (optional): cursor of a connection in autocommit mode where the
+                                  reviewers and products are written. Only the SQL thread
+                                  uses it. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        cursor,
+        collection,
+        sql_insertions,
+        batch_size=None,
+        queue_size=None,
+        shared_cursor=None,
+    ):
+        super().__init__(cursor, collection, sql_insertions, batch_size, shared_cursor)
+        self.error = None
+        # Whether the error was already raised in the main thread
+        self.raised = False
+        self.closed = False
+        self.queues = {
+            "sql": Queue(queue_size or c.TAMANO_COLA),
+            "mongodb": Queue(queue_size or c.TAMANO_COLA),
+        }
+        # Depth seen at each put and seconds waited because the queue was full
+        self.depths = {
+            name: {"max": 0, "total": 0, "puts": 0, "wait": 0.0} for name in self.queues
+        }
+        # Daemon threads, so they never keep the process alive if the load fails
+        self.threads = [
+            Thread(
+                target=self.run,
+                args=(self.queues["sql"], self.write_sql_item),
+                daemon=True,
+            ),
+            Thread(
+                target=self.run,
+                args=(self.queues["mongodb"], self.write_mongodb),
+                daemon=True,
+            ),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def run(self, queue, write):
+        """
+        Loop of a writer thread. After an error the remaining items are discarded and
+        the error is raised in the main thread
+
+        Args:
+            queue (Queue): the queue of the thread
+            write (function): function that writes an item of the queue
+        """
+        while True:
+            item = queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    write(item)
+            except BaseException as e:
+                self.error = e
+            finally:
+                queue.task_done()
+
+    def write_sql_item(self, item):
+        """
+        Writes an item of the SQL queue: a batch of rows or a commit
+
+        Args:
+            item (tuple): ("rows", rows of each table) or ("commit", hooks)
+        """
+        kind, value = item
+        if kind == "rows":
+            self.write_sql(value)
+        else:
+            t = perf_counter()
+            for hook in value:
+                hook(self.cursor)
+            self.cursor.connection.commit()
+            PROFILER.record("commit", perf_counter() - t)
+
+    def check(self):
+        """Raises in the main thread the error of a writer thread, if any."""
+        if self.error is not None:
+            self.raised = True
+            raise self.error
+
+    def put(self, name, item):
+        """
+        Sends an item to a writer thread, recording the depth of its queue
+
+        Args:
+            name (str): name of the queue
+            item: the item to send
+        """
+        self.check()
+        queue = self.queues[name]
+        depth = self.depths[name]
+        size = queue.qsize()
+        depth["max"] = max(depth["max"], size)
+        depth["total"] += size
+        depth["puts"] += 1
+        t = perf_counter()
+        queue.put(item)
+        depth["wait"] += perf_counter() - t
+
+    def queue_depths(self):
+        """
+        Returns the current depth of each queue
+
+        Returns:
+            dict: number of batches waiting in each queue
+        """
+        return {name: queue.qsize() for name, queue in self.queues.items()}
+
+    def flush_sql(self):
+        """Sends the SQL buffers to the SQL thread."""
+        if any(self.rows.values()):
+            rows, self.rows = self.rows, {table_name: [] for table_name in self.rows}
+            self.put("sql", ("rows", rows))
+
+    def flush_mongodb(self):
+        """Sends the MongoDB buffer to the MongoDB thread."""
+        if self.documents:
+            documents, self.documents = self.documents, []
+            self.put("mongodb", documents)
+
+    def commit(self, *hooks):
+        """
+        Sends every buffer and commits the SQL transaction once MongoDB has written all
+        its documents. It returns when the commit is done
+
+        Args:
+            hooks (function): functions called with the cursor before committing, to
+                              write something in the same transaction (e.g. a checkpoint)
+        """
+        self.flush()
+        self.queues["mongodb"].join()
+        self.put("sql", ("commit", hooks))
+        self.queues["sql"].join()
+        self.check()
+
+    def close(self):
+        """
+        Stops the writer threads. It is also called when the load fails, so the error of
+        a thread is only raised if it was not raised before
+        """
+        if self.closed:
+            return
+        self.closed = True
+        # After an error the threads discard what is left, so the queues always empty
+        for queue in self.queues.values():
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if not self.raised:
+            self.check()
+
+    def report(self):
+        """Prints the rows written per second by each sink and the depth of the queues."""
+        super().report()
+        for name, depth in self.depths.items():
+            average = depth["total"] / depth["puts"] if depth["puts"] else 0
+            print(
+                f"{name} queue: max depth {depth['max']}, average {average:.1f}, "
+                f"{depth['wait']:.2f} s waiting for space"
+            )
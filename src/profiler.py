@@ -0,0 +1,175 @@
+"""
+================
+profiler.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the optional instrumentation of load_data.py and insert_dataset.py. It
+records the time spent in each stage of the load (JSON decode, normalization, reviewer
+dedup, product dedup, SQL insert, MongoDB insert and commit) for each data file, and at
+the end of the load prints a report and writes it as JSON.
+
+Regarding the configuration parameters, it is enabled with PERFILADO and the report is
+written to FICHERO_PERFIL. With PERFIL_CPROFILE the main thread is also run under cProfile
+and its statistics are dumped next to the report.
+"""
+
+import config as c
+import cProfile
+import json
+import os
+import random
+from threading import Lock
+
+# Stages in the order they happen, used to sort the report
+STAGES = [
+    "json_decode",
+    "normalization",
+    "reviewer_dedup",
+    "product_dedup",
+    "sql_insert",
+    "mongodb_insert",
+    "commit",
+]
+# Durations kept per stage to compute the percentiles (a uniform sample of all of them)
+SAMPLES = 10000
+PERCENTILES = [50, 90, 99]
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    Returns the p percentile of a sorted list, with the nearest-rank method
+
+    Args:
+        values (list): the values, sorted
+        p (float): the percentile, between 0 and 100
+
+    Returns:
+        float: the percentile, 0 if there are no values
+    """
+    if not values:
+        return 0.0
+    rank = max(1, round(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+class StageProfiler:
+    """
+    Accumulates the calls, total time and a sample of the durations of each stage, for the
+    data file being loaded. When it is disabled record does nothing, so the loaders can
+    call it always
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = Lock()
+        self.rng = random.Random(0)
+        self.stages = {}
+        self.current = None
+        self.cprofile = None
+
+    def reset(self):
+        """Starts a new load, reading PERFILADO and PERFIL_CPROFILE."""
+        self.enabled = c.PERFILADO
+        self.stages = {}
+        self.current = None
+        self.cprofile = None
+        if self.enabled and c.PERFIL_CPROFILE:
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def start_file(self, file_name: str):
+        """
+        Records the following stages under a data file
+
+        Args:
+            file_name (str): name of the data file
+        """
+        self.current = file_name
+
+    def record(self, stage: str, seconds: float):
+        """
+        Adds a duration to a stage of the current file. It may be called from any thread
+
+        Args:
+            stage (str): name of the stage, one of STAGES
+            seconds (float): the duration
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            stats = self.stages.setdefault(self.current, {}).setdefault(
+                stage, {"calls": 0, "time": 0.0, "samples": []}
+            )
+            stats["calls"] += 1
+            stats["time"] += seconds
+            # Reservoir sampling, so the memory does not grow with the number of calls
+            if len(stats["samples"]) < SAMPLES:
+                stats["samples"].append(seconds)
+            else:
+                position = self.rng.randrange(stats["calls"])
+                if position < SAMPLES:
+                    stats["samples"][position] = seconds
+
+    def summary(self) -> dict:
+        """
+        Returns the calls, total seconds and latency percentiles of each stage
+
+        Returns:
+            dict: the statistics of each stage, by data file and stage
+        """
+        summary = {}
+        for file_name, stages in self.stages.items():
+            summary[file_name] = {}
+            for stage in sorted(stages, key=STAGES.index):
+                stats = stages[stage]
+                samples = sorted(stats["samples"])
+                summary[file_name][stage] = {
+                    "calls": stats["calls"],
+                    "time": stats["time"],
+                    **{f"p{p}": percentile(samples, p) for p in PERCENTILES},
+                    "max": samples[-1],
+                }
+        return summary
+
+    def report(self):
+        """Prints the time of each stage of each file and the share of the file total."""
+        for file_name, stages in self.summary().items():
+            print(f"Profile of {file_name}:")
+            total = sum(stats["time"] for stats in stages.values())
+            for stage, stats in stages.items():
+                share = 100 * stats["time"] / total if total else 0
+                latencies = ", ".join(
+                    f"p{p} {1000 * stats[f'p{p}']:.3f}" for p in PERCENTILES
+                )
+                print(
+                    f"  {stage}: {stats['time']:.2f} s ({share:.0f}%), "
+                    f"{stats['calls']} calls, {latencies} ms"
+                )
+
+    def finish(self, path=None):
+        """
+        Prints the report and writes it as JSON, together with the cProfile statistics
+        if they were collected. It does nothing if the profiler is disabled
+
+        Args:
+            path (str, optional): file of the report. Defaults to FICHERO_PERFIL.
+        """
+        if not self.enabled:
+            return
+        path = path or c.FICHERO_PERFIL
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.report()
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(f"{os.path.splitext(path)[0]}.prof")
+        self.enabled = False
+
+
+# Profiler shared by the loaders, the readers and the writers
+PROFILER = StageProfiler()
@@ -0,0 +1,155 @@
+"""
+================
+query_cache.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the cache of query results used by dashboard.py. The data only changes
+when more of it is loaded, so the result of a query is reused until it expires instead of
+running the aggregate again each time a dropdown changes.
+
+Regarding the configuration parameters, the number of results kept is TAMANO_CACHE_CONSULTAS
+and the seconds they are valid is TTL_CACHE_CONSULTAS.
+"""
+
+import config as c
+import re
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+def freeze(value):
+    """
+    Converts the parameters of a query to a hashable value, lists becoming tuples
+
+    Args:
+        value: a parameter or a list of them
+
+    Returns:
+        the value, usable as part of a dictionary key
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Removes the differences of spacing that do not change a query, so the same query
+    written with another indentation has the same key
+
+    Args:
+        sql (str): the SQL query
+
+    Returns:
+        str: the query in a single line, without the final semicolon
+    """
+    return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+
+
+class QueryCache:
+    """
+    Results of queries by normalized SQL and parameters, with at most max_size results
+    (the least recently used is evicted first) that expire after ttl seconds. The hits and
+    misses are counted in total. It can be used from the threads of the server
+
+    Args:
+        max_size (int, optional): results kept. Defaults to TAMANO_CACHE_CONSULTAS.
+        ttl (float, optional): seconds a result is valid. Defaults to TTL_CACHE_CONSULTAS.
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self.max_size = max_size or c.TAMANO_CACHE_CONSULTAS
+        self.ttl = ttl or c.TTL_CACHE_CONSULTAS
+        self.lock = Lock()
+        # key -> (time when it expires, result)
+        self.results = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(sql: str, data=None) -> tuple:
+        """
+        Returns the key of a query
+
+        Args:
+            sql (str): the SQL query
+            data (list, optional): the parameters of the query. Defaults to None.
+
+        Returns:
+            tuple: the normalized query and the parameters
+        """
+        return normalize_sql(sql), freeze(data)
+
+    def get(self, key):
+        """
+        Returns the result stored for a key, counting a hit or a miss
+
+        Args:
+            key (tuple): the key of the query
+
+        Returns:
+            the result, or None if it is not stored or it has expired
+        """
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self.results.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            if entry is not None:
+                del self.results[key]
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, result):
+        """
+        Stores the result of a query, evicting the least recently used one if it is full
+
+        Args:
+            key (tuple): the key of the query
+            result: the result of the query
+        """
+        with self.lock:
+            self.results[key] = (monotonic() + self.ttl, result)
+            self.results.move_to_end(key)
+            while len(self.results) > self.max_size:
+                self.results.popitem(last=False)
+
+    def cached(self, function):
+        """
+        Returns a version of function(sql, data=None) that goes through the cache
+
+        Args:
+            function (function): the function that runs a query
+
+        Returns:
+            function: the function with the cache in front
+        """
+
+        def cached_function(sql, data=None):
+            key = self.key(sql, data)
+            result = self.get(key)
+            if result is None:
+                result = function(sql, data)
+                self.put(key, result)
+            return result
+
+        cached_function.__doc__ = function.__doc__
+        return cached_function
+
+    def clear(self):
+        """Deletes every stored result."""
+        with self.lock:
+            self.results.clear()
+
+    def summary(self) -> dict:
+        """
+        Returns the total hits and misses and the size of the cache
+
+        Returns:
+            dict: the statistics of the cache
+        """
+        with self.lock:
+            return {"size": len(self.results), **self.stats}
@@ -0,0 +1,71 @@
+"""
+================
+sql_indexes.py
+================
+
+Developed by Sergio Jiménez Romero and Alberto Velasco Rodríguez
+
+This file contains the secondary indexes used by the queries of dashboard.py and neo4Jdb.py.
+load_data.py creates them with the keys of the tables and aggregates.py with the summary
+tables, and an index whose columns changed is replaced, so an existing database gets the
+current ones the next time they are created. check_query_plans.py checks that the queries
+use them.
+
+Regarding the configuration parameters, there are none.
+"""
+
+# Name of each index: (table, columns). Most of them contain every column the queries read,
+# so the rows are not read from the table
+SQL_INDEXES = {
+    # Reviews of a reviewer with their types and products (get_users, get_users_and_types)
+    "idx_review_reviewer": ("review", "reviewerID, type, asin"),
+    # Reviews of a product (get_articles, popular_articles). It starts with the columns
+    # of the foreign key of product, so it is also the index of the foreign key
+    "idx_review_product": ("review", "asin, type, reviewerID, overall, reviewTime"),
+    # Reviews of a type by year
+    "idx_review_type_year": ("review", "type, review_year"),
+    # Reviews of a type by time (graph-4)
+    "idx_review_type_time": ("review", "type, unixReviewTime"),
+    # Product types, read without going through every product
+    "idx_product_type": ("product", "type"),
+    # Reviewers by number of reviews (histogram of the dashboard and get_users)
+    "idx_agg_reviewer_reviews": ("agg_reviewer", "reviews"),
+}
+
+
+def create_sql_indexes(cursor, tables) -> list:
+    """
+    Creates the indexes of SQL_INDEXES of the given tables that do not exist, and replaces
+    the ones whose columns are different
+
+    Args:
+        cursor: cursor of the SQL connection
+        tables (list): the tables whose indexes are created
+
+    Returns:
+        list: names of the indexes created or replaced
+    """
+    cursor.execute(
+        """SELECT table_name, index_name,
+                  GROUP_CONCAT(column_name ORDER BY seq_in_index SEPARATOR ', ')
+            FROM information_schema.statistics
+            WHERE table_schema = DATABASE()
+            GROUP BY table_name, index_name;"""
+    )
+    existing = {(table, name): columns for table, name, columns in cursor.fetchall()}
+    changed = []
+    for name, (table, columns) in SQL_INDEXES.items():
+        if table not in tables:
+            continue
+        current = existing.get((table, name))
+        if current is None:
+            cursor.execute(f"ALTER TABLE {table} ADD INDEX {name} ({columns});")
+        elif current.lower() != columns.lower():
+            # Both in one statement, so a foreign key that uses the index is never left without one
+            cursor.execute(
+                f"ALTER TABLE {table} DROP INDEX {name}, ADD INDEX {name} ({columns});"
+            )
+        else:
+            continue
+        changed.append(name)
+    return changed